@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin
 
-from order_app.models import Product, Price, Order, Position
+from order_app.models import Product, Price, Order, Position, ImportJob, Notification, NotificationPreference
 
 
 class PriceInline(admin.TabularInline):
@@ -31,3 +31,21 @@ class OrderAdmin(ModelAdmin):
     list_display = ("user",)
     readonly_fields = ("total", "count")
     inlines = [PositionInline]
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(ModelAdmin):
+    """Импорт прайс-листов"""
+    list_display = ("provider", "status", "processed", "inserted", "updated", "failed", "created_at")
+
+
+@admin.register(Notification)
+class NotificationAdmin(ModelAdmin):
+    """Уведомления поставщиков"""
+    list_display = ("recipient", "kind", "order", "created_at", "sent_at")
+
+
+@admin.register(NotificationPreference)
+class NotificationPreferenceAdmin(ModelAdmin):
+    """Настройки уведомлений"""
+    list_display = ("user", "delivery")
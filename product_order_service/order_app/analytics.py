@@ -0,0 +1,145 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils.dateparse import parse_date
+
+from rest_framework.exceptions import ValidationError
+
+from order_app.models import Order, OrderStatusChoices, Position, Product, ProviderSalesSummary, SalesSummary
+
+
+GROUPS = {
+    'provider': ('provider_id', 'provider__username'),
+    'product': ('product_id', 'product__name'),
+    'category': ('category_id', 'category__name'),
+    'day': ('day',),
+}
+
+
+def _tables():
+    quote = connection.ops.quote_name
+    return {
+        'sales': quote(SalesSummary._meta.db_table),
+        'provider_sales': quote(ProviderSalesSummary._meta.db_table),
+        'position': quote(Position._meta.db_table),
+        'product': quote(Product._meta.db_table),
+        'order': quote(Order._meta.db_table),
+    }
+
+
+def record_sales(orders, sign=1):
+    """ Добавление (sign=1) или вычитание (sign=-1) позиций заказов в сводках продаж за день каждого заказа. Заказы
+    без даты создания (созданные до её появления) в сводки не входят.
+
+    Сводки обновляются двумя INSERT ... ON CONFLICT DO UPDATE на любое число заказов, поэтому одновременные заказы
+    одного товара не теряют друг друга и не требуют чтения сводки перед записью. Вызывать нужно в транзакции, в
+    которой записаны позиции или изменён статус заказов """
+    tables = _tables()
+    day = '(o.created_at AT TIME ZONE %s)::date'
+    order_ids = [order.id for order in orders]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tables["sales"]} (provider_id, product_id, category_id, day, units, revenue, orders) '
+            f'SELECT pos.provider_id, pos.product_id, MAX(prod.category_id), {day}, '
+            f'%s * SUM(pos.quantity), %s * SUM(pos.total), %s * COUNT(DISTINCT pos.order_id) '
+            f'FROM {tables["position"]} pos JOIN {tables["order"]} o ON o.id = pos.order_id '
+            f'JOIN {tables["product"]} prod ON prod.id = pos.product_id '
+            f'WHERE pos.order_id = ANY(%s) AND o.created_at IS NOT NULL GROUP BY 1, 2, 4 '
+            f'ON CONFLICT (provider_id, product_id, day) DO UPDATE SET '
+            f'units = {tables["sales"]}.units + EXCLUDED.units, '
+            f'revenue = {tables["sales"]}.revenue + EXCLUDED.revenue, '
+            f'orders = {tables["sales"]}.orders + EXCLUDED.orders, '
+            f'category_id = EXCLUDED.category_id',
+            [settings.TIME_ZONE, sign, sign, sign, order_ids]
+        )
+        cursor.execute(
+            f'INSERT INTO {tables["provider_sales"]} (provider_id, day, units, revenue, orders) '
+            f'SELECT pos.provider_id, {day}, %s * SUM(pos.quantity), %s * SUM(pos.total), '
+            f'%s * COUNT(DISTINCT pos.order_id) '
+            f'FROM {tables["position"]} pos JOIN {tables["order"]} o ON o.id = pos.order_id '
+            f'WHERE pos.order_id = ANY(%s) AND o.created_at IS NOT NULL GROUP BY 1, 2 '
+            f'ON CONFLICT (provider_id, day) DO UPDATE SET '
+            f'units = {tables["provider_sales"]}.units + EXCLUDED.units, '
+            f'revenue = {tables["provider_sales"]}.revenue + EXCLUDED.revenue, '
+            f'orders = {tables["provider_sales"]}.orders + EXCLUDED.orders',
+            [settings.TIME_ZONE, sign, sign, sign, order_ids]
+        )
+
+
+@transaction.atomic
+def rebuild_sales_summary():
+    """ Пересборка сводок продаж по всем неотменённым заказам с датой создания двумя INSERT ... SELECT. Возвращает
+    число строк сводки по товарам и сводки по поставщикам """
+    tables = _tables()
+    day = '(o.created_at AT TIME ZONE %s)::date'
+    with connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {tables["sales"]}, {tables["provider_sales"]} IN EXCLUSIVE MODE')
+        cursor.execute(f'DELETE FROM {tables["sales"]}')
+        cursor.execute(f'DELETE FROM {tables["provider_sales"]}')
+        cursor.execute(
+            f'INSERT INTO {tables["sales"]} (provider_id, product_id, category_id, day, units, revenue, orders) '
+            f'SELECT pos.provider_id, pos.product_id, MAX(prod.category_id), {day}, '
+            f'SUM(pos.quantity), SUM(pos.total), COUNT(DISTINCT pos.order_id) '
+            f'FROM {tables["position"]} pos JOIN {tables["order"]} o ON o.id = pos.order_id '
+            f'JOIN {tables["product"]} prod ON prod.id = pos.product_id '
+            f'WHERE o.status <> %s AND o.created_at IS NOT NULL GROUP BY 1, 2, 4',
+            [settings.TIME_ZONE, OrderStatusChoices.CANCELLED]
+        )
+        products = cursor.rowcount
+        cursor.execute(
+            f'INSERT INTO {tables["provider_sales"]} (provider_id, day, units, revenue, orders) '
+            f'SELECT pos.provider_id, {day}, SUM(pos.quantity), SUM(pos.total), COUNT(DISTINCT pos.order_id) '
+            f'FROM {tables["position"]} pos JOIN {tables["order"]} o ON o.id = pos.order_id '
+            f'WHERE o.status <> %s AND o.created_at IS NOT NULL GROUP BY 1, 2',
+            [settings.TIME_ZONE, OrderStatusChoices.CANCELLED]
+        )
+        providers = cursor.rowcount
+    return products, providers
+
+
+class SalesReport:
+    """ Отчёт о продажах из сводок: единицы, выручка и число заказов с группировкой по поставщику, товару, категории
+    и дню (group_by=product,day) за период date_from - date_to.
+
+    Группировки без товара и категории читаются из сводки по поставщикам, в которой заказ с несколькими товарами
+    посчитан один раз, остальные - из сводки по товарам, где orders - число заказов с товаром. """
+
+    def __init__(self, params, provider=None):
+        self.groups = [group for group in params.get('group_by', '').split(',') if group] or ['day']
+        unknown = set(self.groups) - set(GROUPS)
+        if unknown:
+            raise ValidationError({"group_by": f"Неизвестная группировка: {', '.join(sorted(unknown))}"})
+        self.date_from = self._date(params, 'date_from')
+        self.date_to = self._date(params, 'date_to')
+        self.provider = provider
+
+    @staticmethod
+    def _date(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValidationError({name: "Дата должна быть в формате ГГГГ-ММ-ДД"})
+        return date
+
+    def queryset(self):
+        model = SalesSummary if {'product', 'category'} & set(self.groups) else ProviderSalesSummary
+        queryset = model.objects.all()
+        if self.provider is not None:
+            queryset = queryset.filter(provider=self.provider)
+        if self.date_from is not None:
+            queryset = queryset.filter(day__gte=self.date_from)
+        if self.date_to is not None:
+            queryset = queryset.filter(day__lte=self.date_to)
+        return queryset
+
+    def rows(self):
+        fields = [field for group in self.groups for field in GROUPS[group]]
+        keys = [GROUPS[group][0] for group in self.groups]
+        return list(self.queryset().values(*fields).annotate(
+            units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders')
+        ).filter(units__gt=0).order_by(*keys))
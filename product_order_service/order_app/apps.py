@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'order_app'
+
+    def ready(self):
+        from order_app import signals  # noqa: F401
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import math
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.http import JsonResponse
+
+from order_app.models import Order
+from order_app.views import CategoryView, OrderViewSet, ProductViewSet
+
+logger = logging.getLogger(__name__)
+
+product_list_view = ProductViewSet.as_view({'get': 'list'})
+product_detail_view = ProductViewSet.as_view({'get': 'retrieve'})
+category_list_view = CategoryView.as_view({'get': 'list'})
+order_detail_view = OrderViewSet.as_view({'get': 'retrieve'})
+
+
+def call_view(view, request, **kwargs):
+    """ Выполнение синхронного представления с отрисовкой ответа. Соединение с базой потока пула закрывается или
+    проверяется до и после запроса, как в начале и конце обычного запроса """
+    close_old_connections()
+    try:
+        response = view(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+async def run_view(view, request, **kwargs):
+    """ Запрос к базе в общем пуле потоков (в Django 3.2 ORM синхронный), а не в единственном потоке, в котором
+    ASGI-обработчик выполняет синхронные представления. Пока запрос ждёт, поток не занят """
+    return await sync_to_async(call_view, thread_sensitive=False)(view, request, **kwargs)
+
+
+async def product_list(request):
+    """ Список товаров, как /api/v1/products/ """
+    return await run_view(product_list_view, request)
+
+
+async def product_detail(request, pk):
+    """ Карточка товара, как /api/v1/products/<id>/ """
+    return await run_view(product_detail_view, request, pk=pk)
+
+
+async def category_list(request):
+    """ Список категорий, как /api/v1/categories/ """
+    return await run_view(category_list_view, request)
+
+
+def order_statuses(order_ids):
+    """ Статусы заказов одним запросом к базе """
+    close_old_connections()
+    try:
+        return dict(Order.objects.filter(id__in=order_ids).values_list('id', 'status'))
+    finally:
+        close_old_connections()
+
+
+class OrderStatusWatcher:
+    """ Ожидание смены статуса заказов для всех долгих опросов процесса. Раз в ORDER_LONG_POLL_INTERVAL секунд
+    статусы всех ожидаемых заказов читаются одним запросом, поэтому число запросов к базе и занятых потоков не
+    зависит от числа ожидающих клиентов """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.waiters = defaultdict(list)
+        self.task = None
+
+    async def wait(self, order_id, known, timeout):
+        """ Ожидание, пока статус заказа отличается от known, не дольше timeout секунд. True, если статус изменился """
+        waiter = (known, self.loop.create_future())
+        self.waiters[order_id].append(waiter)
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.run())
+        try:
+            done, _ = await asyncio.wait({waiter[1]}, timeout=timeout)
+            return bool(done)
+        finally:
+            self.waiters[order_id].remove(waiter)
+            if not self.waiters[order_id]:
+                del self.waiters[order_id]
+
+    async def run(self):
+        while self.waiters:
+            await asyncio.sleep(settings.ORDER_LONG_POLL_INTERVAL)
+            if not self.waiters:
+                break
+            try:
+                statuses = await sync_to_async(order_statuses, thread_sensitive=False)(list(self.waiters))
+            except DatabaseError as error:
+                logger.warning("Статусы заказов для долгого опроса не прочитаны: %s", error)
+                continue
+            for order_id, waiters in self.waiters.items():
+                for known, future in waiters:
+                    if statuses.get(order_id) != known and not future.done():
+                        future.set_result(None)
+
+
+_watcher = None
+
+
+def get_watcher():
+    """ Наблюдатель за статусами в цикле событий текущего процесса """
+    global _watcher
+    if _watcher is None or _watcher.loop is not asyncio.get_running_loop():
+        _watcher = OrderStatusWatcher()
+    return _watcher
+
+
+async def order_detail(request, pk):
+    """ Заказ, как /api/v1/orders/<id>/, с долгим опросом статуса: с параметрами ?status=NEW&wait=30 ответ приходит,
+    как только статус заказа отличается от status, или через wait секунд (не больше ORDER_LONG_POLL_TIMEOUT).
+    Представление с авторизацией и проверкой доступа выполняется в начале и после смены статуса, а во время ожидания
+    статус проверяет OrderStatusWatcher """
+    known = request.GET.get('status')
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    if not math.isfinite(wait):
+        return JsonResponse(data={"wait": "Укажите время ожидания в секундах"}, status=400)
+    wait = min(max(wait, 0), settings.ORDER_LONG_POLL_TIMEOUT)
+    response = await run_view(order_detail_view, request, pk=pk)
+    if known is None or not wait or response.status_code != 200 or response.data['status'] != known:
+        return response
+    if not await get_watcher().wait(response.data['id'], known, wait):
+        return response
+    return await run_view(order_detail_view, request, pk=pk)
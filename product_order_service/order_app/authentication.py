@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+# поля пользователя, которые хранятся в кэше; остальные поля загружаются из базы при первом обращении
+SNAPSHOT_FIELDS = ('id', 'username', 'is_superuser', 'is_staff', 'is_active')
+
+
+class LocalLRU:
+    """ Ограниченный по размеру кэш процесса: при переполнении вытесняются давно не использованные записи, запись
+    живёт не дольше timeout секунд """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_tokens = LocalLRU(settings.AUTH_CACHE_LOCAL_SIZE, settings.AUTH_CACHE_LOCAL_TIMEOUT)
+
+
+def token_cache_key(key):
+    """ Ключ кэша токена. В кэше хранится хэш токена, а не сам токен """
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_snapshot(user):
+    return {name: getattr(user, name) for name in SNAPSHOT_FIELDS}
+
+
+def user_from_snapshot(snapshot):
+    """ Пользователь из кэша: поля снимка загружены, остальные отложены """
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in snapshot]
+    return User.from_db(None, names, [snapshot[name] for name in names])
+
+
+def invalidate_tokens(keys):
+    """ Удаление токенов из кэша сразу и ещё раз после фиксации текущей транзакции: иначе параллельный запрос успел
+    бы снова закэшировать старые данные. Кэши других процессов обновятся не позже чем через AUTH_CACHE_LOCAL_TIMEOUT
+    секунд """
+    cache_keys = [token_cache_key(key) for key in keys]
+
+    def invalidate():
+        cache.delete_many(cache_keys)
+        for cache_key in cache_keys:
+            local_tokens.delete(cache_key)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ Авторизация по токену без запроса к базе: токен сопоставляется со снимком пользователя (SNAPSHOT_FIELDS) в
+    кэше процесса, затем в общем кэше, и только при промахе обоих - запросом токена с пользователем """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        snapshot = local_tokens.get(cache_key)
+        if snapshot is None:
+            snapshot = cache.get(cache_key)
+            if snapshot is None:
+                try:
+                    token = Token.objects.select_related('user').get(key=key)
+                except Token.DoesNotExist:
+                    raise AuthenticationFailed(_('Invalid token.'))
+                snapshot = user_snapshot(token.user)
+                cache.set(cache_key, snapshot, timeout=settings.AUTH_CACHE_TIMEOUT)
+            local_tokens.set(cache_key, snapshot)
+        if not snapshot['is_active']:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        user = user_from_snapshot(snapshot)
+        return user, Token(key=key, user=user)
@@ -0,0 +1,91 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from rest_framework.exceptions import ValidationError
+
+from order_app.analytics import record_sales
+from order_app.models import NotificationKindChoices, Order, Position, Price
+from order_app.notifications import notify_orders, notify_providers
+from order_app.serializers import OrderSerializer, check_prices, load_prices, order_positions
+from order_app.stock import reserve_stock, stock_demand
+
+
+class BulkOrderCreator:
+    """ Создание пачки заказов покупателя одним запросом.
+
+    Все заказы проверяются до записи: данные - сериализатором заказа, цены и активность поставщиков - одним запросом
+    на всю пачку. Правильные заказы записываются частями по chunk_size (ORDER_BULK_CHUNK_SIZE), каждая часть - в
+    своей транзакции: остатки её цен блокируются и читаются одним запросом, заказы и позиции записываются двумя
+    bulk_create, остатки резервируются одним UPDATE ... FROM VALUES, сводки продаж пополняются двумя запросами.
+    Покупатель и каждый поставщик получают одно письмо на часть. Ошибка одного заказа не отменяет остальные:
+    результат возвращается по каждому заказу в порядке запроса """
+
+    def __init__(self, user, chunk_size=None):
+        self.user = user
+        self.chunk_size = chunk_size or settings.ORDER_BULK_CHUNK_SIZE
+        self.results = []
+
+    def create(self, orders):
+        self.results = [None] * len(orders)
+        valid = []
+        for index, data in enumerate(orders):
+            serializer = OrderSerializer(data=data)
+            if not serializer.is_valid():
+                self.fail(index, serializer.errors)
+                continue
+            items = [item for position in serializer.validated_data['position'].values() for item in position]
+            valid.append((index, items))
+        prices = load_prices([item for _, items in valid for item in items])
+        checked = []
+        for index, items in valid:
+            try:
+                check_prices(items, prices)
+            except ValidationError as error:
+                self.fail(index, error.detail)
+                continue
+            checked.append((index, items))
+        for start in range(0, len(checked), self.chunk_size):
+            self.create_chunk(checked[start:start + self.chunk_size], prices)
+        return self.results
+
+    @transaction.atomic
+    def create_chunk(self, chunk, prices):
+        """ Запись части заказов. Заказы, которым не хватило остатков, отклоняются в порядке запроса """
+        demands = [(index, items, stock_demand(items, prices)) for index, items in chunk]
+        price_ids = sorted({price_id for _, _, demand in demands for price_id in demand})
+        stock = dict(Price.objects.select_for_update().filter(id__in=price_ids).order_by('id')
+                     .values_list('id', 'quantity'))
+        reserved = Counter()
+        accepted = []
+        for index, items, demand in demands:
+            if any(stock.get(price_id, 0) is not None and stock.get(price_id, 0) - reserved[price_id] < quantity
+                   for price_id, quantity in demand.items()):
+                self.fail(index, {"Stock": "Недостаточно товара на складе."})
+                continue
+            reserved.update(demand)
+            accepted.append((index, items))
+        if not accepted:
+            return
+        orders = []
+        positions = []
+        for index, items in accepted:
+            order = Order(user=self.user)
+            order_items, order.count, order.total = order_positions(order, items, prices)
+            orders.append(order)
+            positions.extend(order_items)
+        Order.objects.bulk_create(orders)
+        for position in positions:
+            position.order_id = position.order.id
+        Position.objects.bulk_create(positions)
+        reserve_stock(reserved)
+        record_sales(orders)
+        notify_orders(self.user, NotificationKindChoices.ORDER_CONFIRMED, orders)
+        notify_providers(orders, NotificationKindChoices.NEW_ORDER)
+        for (index, _), order in zip(accepted, orders):
+            self.results[index] = {'index': index, 'id': order.id, 'count': order.count,
+                                   'total': str(order.total)}
+
+    def fail(self, index, errors):
+        self.results[index] = {'index': index, 'errors': errors}
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+from rest_framework.utils.encoders import JSONEncoder
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+
+
+def catalogue_version():
+    """ Текущая версия каталога. Если ключ вытеснен из кэша, версия начинается заново с текущего времени, чтобы не
+    совпасть с версиями, под которыми в кэше могли остаться ответы """
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version():
+    """ Смена версии каталога после фиксации текущей транзакции: закэшированные ответы перестают использоваться """
+    transaction.on_commit(_increment_catalogue_version)
+
+
+def _increment_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def freeze(data):
+    """ Данные ответа в виде простых структур для кэша и их ETag """
+    content = json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+    return '"{}"'.format(hashlib.md5(content.encode()).hexdigest()), json.loads(content)
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = {tag.strip().replace('W/', '', 1) for tag in header.split(',')}
+    return '*' in tags or etag in tags
+
+
+def cached_catalogue(view_method):
+    """ Кэширование ответов каталога с версией каталога в ключе, ETag и ответом 304 на условный GET """
+
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        path = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = f'catalogue:{catalogue_version()}:{path}'
+        cached = cache.get(key)
+        if cached is None:
+            response = view_method(view, request, *args, **kwargs)
+            if response.status_code != HTTP_200_OK:
+                return response
+            cached = freeze(response.data)
+            cache.set(key, cached, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        etag, data = cached
+        if etag_matches(request, etag):
+            response = Response(status=HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data=data)
+        response['ETag'] = etag
+        return response
+
+    return wrapper
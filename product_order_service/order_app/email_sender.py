@@ -1,102 +1,83 @@
-import smtplib
 import os
-import ssl
-from email.message import EmailMessage
+from collections import defaultdict
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from functools import lru_cache
 
-from order_app.models import Position
-from product_order_service import celery_app
+from django.template.loader import get_template
 
+from order_app.models import NotificationKindChoices
 
-@celery_app.task
-def send_message_reg_confirm(emails):
-    message = EmailMessage()
-    message["From"] = os.getenv('MY_EMAIL')
-    message["To"] = emails[1]
-    message["Subject"] = "Подтверждение о регистрации"
-    message.set_content(f"{emails[0]}!\n"
-                        "Поздравляем! Вы только что зарегистрировались в нашем сервисе заказов!")
-    context = ssl.create_default_context()
-    with smtplib.SMTP("smtp.mail.ru", port=587) as smtp:
-        smtp.starttls(context=context)
-        smtp.login(os.getenv('MY_EMAIL'), os.getenv('MY_EMAIL_PASSWORD'))
-        smtp.send_message(message)
-
-
-@celery_app.task
-def order_confirm(order_confirm_for_email):
-    order_list = []
-    user = order_confirm_for_email[0].user
-    total = order_confirm_for_email[0].total
-    user_email = user.email
-    for item in order_confirm_for_email[1]:
-        order_dict = {'provider': item.provider, 'product': item.product, 'quantity': item.quantity}
-        order_list.append(order_dict)
-    message = EmailMessage()
-    message["From"] = os.getenv('MY_EMAIL')
-    message["To"] = user_email
-    message["Subject"] = "Подтверждение заказа"
-    message.set_content(f"{str(user).capitalize()}!\nВаш заказ: №: {order_confirm_for_email[0].id} на сумму {total}\n"
-                        f"Информация о товаре:\n"
-                        f"{order_details(order_list)}")
-    context = ssl.create_default_context()
-    with smtplib.SMTP("smtp.mail.ru", port=587) as smtp:
-        smtp.starttls(context=context)
-        smtp.login(os.getenv('MY_EMAIL'), os.getenv('MY_EMAIL_PASSWORD'))
-        smtp.send_message(message)
-
-
-def order_details(order_list):
-    order_details_list = []
-    for position in order_list:
-        message = f"поставщик: {position['provider']}, товар: {position['product']}, " \
-                  f"количество: {position['quantity']}".replace("\n", "")
-        order_details_list.append(message)
-    return order_details_list
-
-
-@celery_app.task
-def message_to_provider(order_confirm_for_email):
-    user = order_confirm_for_email[0].user
-    email_adresses = [data.provider.email for data in order_confirm_for_email[1]]
-    message = EmailMessage()
-    message["From"] = os.getenv('MY_EMAIL')
-    message["To"] = set(email_adresses)
-    message["Subject"] = "Новый заказ"
-    message.set_content(f"\nЗаказ: №: {order_confirm_for_email[0].id} для {str(user).capitalize()}\n"
-                        f"У Вас новый заказ! "
-                        f"Просмотрите более подробную информацию на странице: http://127.0.0.1:8000/api/v1/orders/")
-    context = ssl.create_default_context()
-    with smtplib.SMTP("smtp.mail.ru", port=587) as smtp:
-        smtp.starttls(context=context)
-        smtp.login(os.getenv('MY_EMAIL'), os.getenv('MY_EMAIL_PASSWORD'))
-        smtp.send_message(message)
-
-
-@celery_app.task
-def cancelled_status_message(order, user):
-    provider_info = Position.objects.filter(order_id=order.id)
-    email_adresses = [data.provider.email for data in provider_info]
-    message = EmailMessage()
-    message["From"] = os.getenv('MY_EMAIL')
-    message["To"] = set(email_adresses)
-    message["Subject"] = "Статус заказа изменён"
-    message.set_content(f"\nПокупатель {str(user).capitalize()} отменил заказ №: {order.id}!\n")
-    context = ssl.create_default_context()
-    with smtplib.SMTP("smtp.mail.ru", port=587) as smtp:
-        smtp.starttls(context=context)
-        smtp.login(os.getenv('MY_EMAIL'), os.getenv('MY_EMAIL_PASSWORD'))
-        smtp.send_message(message)
-
-
-@celery_app.task
-def changed_status_message(order, user):
-    message = EmailMessage()
+ORDERS_URL = "http://127.0.0.1:8000/api/v1/orders/"
+
+
+@lru_cache(maxsize=None)
+def email_templates(name):
+    """ Текстовый и HTML шаблоны письма. Шаблоны компилируются один раз на процесс, а не на каждое письмо """
+    return get_template(f'order_app/email/{name}.txt'), get_template(f'order_app/email/{name}.html')
+
+
+def new_message(to, subject, template, context):
+    """ Письмо из двух частей: текст и HTML, отрисованные скомпилированными шаблонами. Все данные контекста должны
+    быть загружены заранее: отрисовка не делает запросов к базе. Письмо собирается классами email.mime, а не
+    EmailMessage: разбор заголовков политикой email.policy.default стоит дороже отрисовки самих шаблонов """
+    text, html = email_templates(template)
+    message = MIMEMultipart('alternative')
     message["From"] = os.getenv('MY_EMAIL')
-    message["To"] = user.email
-    message["Subject"] = "Статус заказа изменён"
-    message.set_content(f"\n{str(order.user).capitalize()}! Статус Вашего заказа №: {order.id} изменён на {order.status}!\n")
-    context = ssl.create_default_context()
-    with smtplib.SMTP("smtp.mail.ru", port=587) as smtp:
-        smtp.starttls(context=context)
-        smtp.login(os.getenv('MY_EMAIL'), os.getenv('MY_EMAIL_PASSWORD'))
-        smtp.send_message(message)
+    message["To"] = to
+    message["Subject"] = Header(subject, 'utf-8')
+    message.attach(MIMEText(text.render(context), 'plain', 'utf-8'))
+    message.attach(MIMEText(html.render(context), 'html', 'utf-8'))
+    return message
+
+
+def send_message_reg_confirm(notification):
+    user = notification.recipient
+    return new_message(user.email, "Подтверждение о регистрации", 'registered', {'user': user})
+
+
+def order_confirm(recipient, notifications):
+    """ Одно письмо покупателю с подтверждением всех заказов пачки. Позиции с товарами и поставщиками должны быть
+    загружены заранее """
+    orders = sorted((notification.order for notification in notifications), key=lambda order: order.id)
+    if len(orders) == 1:
+        subject = "Подтверждение заказа"
+    else:
+        subject = f"Подтверждение заказов: {len(orders)}"
+    return new_message(recipient.email, subject, 'order_confirmed', {'user': recipient, 'orders': orders})
+
+
+def changed_status_message(notification):
+    order = notification.order
+    return new_message(notification.recipient.email, "Статус заказа изменён", 'status_changed',
+                       {'user': order.user, 'order': order})
+
+
+def provider_digest(recipient, notifications):
+    """ Одно письмо поставщику со списком номеров заказов по каждому событию """
+    orders = defaultdict(list)
+    for notification in notifications:
+        orders[notification.kind].append(notification.order_id)
+    if len(notifications) == 1:
+        subject = notifications[0].get_kind_display()
+    else:
+        subject = f"Заказы: {len(notifications)} событий"
+    events = [(kind.label, sorted(orders[kind])) for kind in DIGEST_KINDS if orders[kind]]
+    return new_message(recipient.email, subject, 'provider_digest',
+                       {'user': recipient, 'events': events, 'orders_url': ORDERS_URL})
+
+
+# события, которые поставщик может получать сводкой
+DIGEST_KINDS = (NotificationKindChoices.NEW_ORDER, NotificationKindChoices.ORDER_CANCELLED)
+
+# письма, в которые объединяются все уведомления получателя одного вида из пачки
+GROUPED_MESSAGES = {
+    NotificationKindChoices.ORDER_CONFIRMED: order_confirm,
+}
+
+# письма, которые отправляются по одному на каждое уведомление
+MESSAGES = {
+    NotificationKindChoices.REGISTERED: send_message_reg_confirm,
+    NotificationKindChoices.STATUS_CHANGED: changed_status_message,
+}
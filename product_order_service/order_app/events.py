@@ -0,0 +1,336 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+from rest_framework.exceptions import AuthenticationFailed
+
+from order_app.authentication import CachedTokenAuthentication
+from order_app.models import Position
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = '/api/v1/orders/events/'
+
+# через сколько миллисекунд клиент переподключается после обрыва соединения
+RETRY_MS = 3000
+
+# Публикация события: номер события - общий счётчик KEYS[1], событие добавляется в историю каждого получателя
+# (KEYS[2:], отсортированные множества по номеру, не длиннее ARGV[2] событий) и рассылается в канал ARGV[4] строкой
+# "номер получатели_через_запятую json". Всё выполняется атомарно, поэтому события приходят по возрастанию номеров
+PUBLISH = """
+local id = redis.call('INCR', KEYS[1])
+local size = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local event = id .. ' ' .. ARGV[1]
+for i = 2, #KEYS do
+    redis.call('ZADD', KEYS[i], id, event)
+    redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -size - 1)
+    redis.call('EXPIRE', KEYS[i], ttl)
+end
+redis.call('PUBLISH', ARGV[4], id .. ' ' .. ARGV[5] .. ' ' .. ARGV[1])
+return id
+"""
+
+
+def make_event(event_id, payload):
+    """ Событие из номера и json с полями event и data """
+    event = json.loads(payload)
+    event['id'] = int(event_id)
+    return event
+
+
+def format_event(event):
+    """ Событие в формате text/event-stream """
+    data = json.dumps(event['data'], ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n".encode()
+
+
+class Subscription:
+    """ Очередь событий одного соединения в его цикле событий. Если клиент не успевает читать и в очереди накопилось
+    ORDER_EVENTS_QUEUE_SIZE событий, очередь очищается и соединение закрывается: клиент переподключится с
+    Last-Event-ID и получит пропущенное из истории """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def offer(self, event):
+        if self.queue.qsize() >= settings.ORDER_EVENTS_QUEUE_SIZE:
+            self.close()
+        else:
+            self.queue.put_nowait(event)
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventHub:
+    """ Открытые потоки событий процесса по пользователям. События передаются в цикл событий соединения через
+    call_soon_threadsafe, поэтому рассылать их можно из любого потока """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription()
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[user_id]
+
+    def dispatch(self, user_ids, event):
+        with self._lock:
+            subscriptions = [subscription for user_id in user_ids
+                             for subscription in self._subscriptions.get(user_id, ())]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.offer, event)
+
+    def close_all(self):
+        """ Закрытие всех потоков процесса: после них клиенты переподключатся с Last-Event-ID """
+        with self._lock:
+            subscriptions = [subscription for user in self._subscriptions.values() for subscription in user]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.close)
+
+
+hub = EventHub()
+
+
+class MemoryEventBroker:
+    """ Брокер событий в памяти процесса: для тестов и сервера из одного процесса """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._last_id = 0
+        self._history = defaultdict(lambda: deque(maxlen=settings.ORDER_EVENTS_HISTORY))
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def publish(self, user_ids, kind, data):
+        with self._lock:
+            self._last_id += 1
+            event = {'id': self._last_id, 'event': kind, 'data': data}
+            for user_id in user_ids:
+                self._history[user_id].append(event)
+        self.hub.dispatch(user_ids, event)
+        return event['id']
+
+    def history(self, user_id, last_id):
+        """ События пользователя после last_id """
+        with self._lock:
+            return [event for event in self._history.get(user_id, ()) if event['id'] > last_id]
+
+
+class RedisEventBroker:
+    """ Брокер событий на Redis: событие публикуется одним вызовом скрипта PUBLISH в канал ORDER_EVENTS_CHANNEL, а
+    последние ORDER_EVENTS_HISTORY событий пользователя хранятся ORDER_EVENTS_HISTORY_TTL секунд для продолжения потока
+    с Last-Event-ID. Каждый процесс держит одну подписку на канал в отдельном потоке и раздаёт события своим
+    соединениям, а не открывает подписку на каждое соединение """
+
+    def __init__(self, hub, client=None, listener=None):
+        self.hub = hub
+        self.client = client or redis.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL,
+                                                     socket_timeout=settings.ORDER_EVENTS_REDIS_TIMEOUT,
+                                                     socket_connect_timeout=settings.ORDER_EVENTS_REDIS_TIMEOUT)
+        # подписка ждёт сообщений без ограничения времени, поэтому у неё своё соединение
+        self.listener = listener or redis.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+        self.script = self.client.register_script(PUBLISH)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def history_key(user_id):
+        return f'order_events:history:{user_id}'
+
+    def start(self):
+        """ Запуск подписки процесса на канал при первом открытом потоке """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.listen, name='order-events', daemon=True)
+                self._thread.start()
+
+    def listen(self):
+        reconnect = False
+        while True:
+            try:
+                pubsub = self.listener.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(settings.ORDER_EVENTS_CHANNEL)
+                if reconnect:
+                    # события, опубликованные без подписки, клиенты получат из истории
+                    self.hub.close_all()
+                for message in pubsub.listen():
+                    self.receive(message['data'])
+            except redis.RedisError as error:
+                logger.warning("Подписка на события заказов прервана: %s", error)
+                reconnect = True
+                time.sleep(1)
+
+    def receive(self, message):
+        event_id, users, payload = message.decode().split(' ', 2)
+        self.hub.dispatch([int(user_id) for user_id in users.split(',')], make_event(event_id, payload))
+
+    def publish(self, user_ids, kind, data):
+        payload = json.dumps({'event': kind, 'data': data}, ensure_ascii=False)
+        return self.script(
+            keys=['order_events:id', *[self.history_key(user_id) for user_id in user_ids]],
+            args=[payload, settings.ORDER_EVENTS_HISTORY, settings.ORDER_EVENTS_HISTORY_TTL,
+                  settings.ORDER_EVENTS_CHANNEL, ','.join(str(user_id) for user_id in user_ids)],
+        )
+
+    def history(self, user_id, last_id):
+        """ События пользователя после last_id """
+        events = self.client.zrangebyscore(self.history_key(user_id), f'({last_id}', '+inf')
+        return [make_event(*event.decode().split(' ', 1)) for event in events]
+
+
+_broker = None
+
+
+def get_broker():
+    """ Брокер событий процесса, класс задаётся настройкой ORDER_EVENTS_BROKER """
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.ORDER_EVENTS_BROKER)(hub)
+    return _broker
+
+
+def publish_status_change(order, status):
+    """ Событие смены статуса заказа для покупателя и поставщиков заказа. Публикуется после фиксации транзакции;
+    недоступный брокер не отменяет смену статуса """
+    data = {'order': order.id, 'status': status, 'previous': order.status}
+
+    def publish():
+        providers = Position.objects.filter(order=order.id).values_list('provider', flat=True).distinct()
+        try:
+            get_broker().publish(sorted({order.user_id, *providers}), 'status', data)
+        except redis.RedisError as error:
+            logger.warning("Событие заказа %s не опубликовано: %s", order.id, error)
+
+    transaction.on_commit(publish)
+
+
+def token_user_id(authorization):
+    """ id пользователя по заголовку Authorization: Token ... или None """
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0] != CachedTokenAuthentication.keyword:
+        return None
+    close_old_connections()
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(parts[1])
+        return user.id
+    except AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+
+
+async def send_json(send, status, data, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': json.dumps(data, ensure_ascii=False).encode()})
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class OrderEventStream:
+    """ Поток событий заказов пользователя (text/event-stream) как ASGI-приложение. Django 3.2 отдаёт потоковый ответ
+    синхронным итератором, который держал бы поток на всё время соединения, поэтому поток обслуживается в обход
+    Django: соединение занимает только очередь в цикле событий. Раз в ORDER_EVENTS_KEEPALIVE секунд отправляется
+    комментарий, чтобы прокси не закрыли соединение. С заголовком Last-Event-ID сначала отправляются события из
+    истории после этого номера """
+
+    async def __call__(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            await send_json(send, 405, {"detail": f'Метод "{scope["method"]}" не разрешен.'}, [(b'allow', b'GET')])
+            return
+        headers = dict(scope['headers'])
+        user_id = await sync_to_async(token_user_id, thread_sensitive=False)(
+            headers.get(b'authorization', b'').decode('latin-1')
+        )
+        if user_id is None:
+            await send_json(send, 401, {"detail": "Учетные данные не были предоставлены."},
+                            [(b'www-authenticate', b'Token')])
+            return
+        try:
+            last_id = int(headers[b'last-event-id'])
+        except (KeyError, ValueError):
+            last_id = None
+        broker = get_broker()
+        broker.start()
+        subscription = hub.subscribe(user_id)
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                    (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+            await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+            sent = 0
+            if last_id is not None:
+                # подписка уже открыта, поэтому события между чтением истории и подпиской не теряются, а
+                # повторы отбрасываются по номеру
+                sent = last_id
+                for event in await sync_to_async(broker.history, thread_sensitive=False)(user_id, last_id):
+                    await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+                    sent = event['id']
+            await self.stream(subscription, receive, send, sent)
+        finally:
+            hub.unsubscribe(user_id, subscription)
+
+    @staticmethod
+    async def stream(subscription, receive, send, sent):
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            while True:
+                get = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait({get, disconnect}, timeout=settings.ORDER_EVENTS_KEEPALIVE,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    if disconnect in done:
+                        return
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                    continue
+                event = get.result()
+                if event is None:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                if event['id'] > sent:
+                    await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+                    sent = event['id']
+        finally:
+            disconnect.cancel()
+
+
+def with_event_stream(application):
+    """ ASGI-приложение, которое отдаёт EVENTS_PATH потоку событий заказов, а остальные запросы - application """
+    stream = OrderEventStream()
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+            return await stream(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return router
@@ -0,0 +1,65 @@
+import math
+import re
+
+from django.db.models import JSONField, Lookup, Q
+
+from rest_framework.exceptions import ValidationError
+
+PARAMETER_FILTER = re.compile(r'^param\[(?P<name>.+)\](?:__(?P<lookup>gte|gt|lte|lt))?$')
+COMPARISONS = {'gte': '>=', 'gt': '>', 'lte': '<=', 'lt': '<'}
+
+
+@JSONField.register_lookup
+class JSONPathMatch(Lookup):
+    """ Проверка jsonpath-предиката (оператор @@), обслуживается GIN-индексом по полю """
+
+    lookup_name = 'jsonpath_match'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} @@ {rhs}::jsonpath', lhs_params + rhs_params
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', [value]
+
+
+def parse_number(value):
+    """ Число из строки параметра запроса или None. nan и бесконечности числом не считаются: в JSON и jsonpath их
+    нет """
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(number):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def jsonpath_key(name):
+    return '"{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def filter_parameters(queryset, query_params):
+    """ Фильтр товаров по параметрам: ?param[Цвет]=красный или ?param[Встроенная память (Гб)]__gte=256.
+
+    Равенство проверяется вхождением (@>), сравнение - jsonpath-предикатом вместе с проверкой наличия ключа (?),
+    оба условия обслуживаются GIN-индексом по полю parameters. """
+    for key, value in query_params.items():
+        match = PARAMETER_FILTER.match(key)
+        if match is None:
+            continue
+        name, lookup = match.group('name'), match.group('lookup')
+        number = parse_number(value)
+        if lookup is None:
+            condition = Q(parameters__contains={name: value})
+            if number is not None:
+                condition |= Q(parameters__contains={name: number})
+            queryset = queryset.filter(condition)
+        elif number is None:
+            raise ValidationError({key: "Для сравнения нужно указать число"})
+        else:
+            predicate = f'$.{jsonpath_key(name)} {COMPARISONS[lookup]} {number}'
+            queryset = queryset.filter(parameters__has_key=name, parameters__jsonpath_match=predicate)
+    return queryset
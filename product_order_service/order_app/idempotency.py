@@ -0,0 +1,111 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from rest_framework.response import Response
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_422_UNPROCESSABLE_ENTITY
+from rest_framework.utils.encoders import JSONEncoder
+
+from order_app.models import IdempotencyKey
+from product_order_service import celery_app
+
+
+def request_fingerprint(request):
+    """ Отпечаток тела запроса: повтор с тем же ключом должен отправлять те же данные. Загруженные файлы учитываются
+    по содержимому """
+    digest = hashlib.sha256()
+    data = {name: value for name, value in request.data.items() if name not in request.FILES}
+    digest.update(json.dumps(data, cls=JSONEncoder, sort_keys=True).encode())
+    for name, file in sorted(request.FILES.items()):
+        digest.update(name.encode())
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+    return digest.hexdigest()
+
+
+def replay(record, fingerprint):
+    """ Сохранённый ответ на повтор запроса или ошибка, если с ключом пришли другие данные """
+    if record.fingerprint != fingerprint:
+        return Response(data={"Idempotency-Key": "Ключ уже использован с другими данными"},
+                        status=HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(data=record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def completed_key(view, request):
+    """ Выполненный ключ идемпотентности запроса к действию с @idempotent или None. Найденная запись сохраняется в
+    запросе, чтобы idempotent не читал её второй раз """
+    handler = getattr(view, view.action or '', None)
+    scope = getattr(handler, 'idempotency_scope', None)
+    key = request.headers.get('Idempotency-Key')
+    if (scope is None or not key or not request.user.is_authenticated
+            or len(key) > IdempotencyKey._meta.get_field('key').max_length):
+        return None
+    request.idempotency_record = IdempotencyKey.objects.filter(
+        user_id=request.user.id, scope=scope, key=key, status_code__isnull=False
+    ).first()
+    return request.idempotency_record
+
+
+class IdempotentThrottleMixin:
+    """ Повтор запроса с уже выполненным ключом идемпотентности не расходует лимит частоты: DRF проверяет лимиты до
+    вызова действия, а повтор только отдаёт сохранённый ответ, поэтому повторы клиента при плохой сети не получают
+    429 вместо ответа """
+
+    def check_throttles(self, request):
+        if completed_key(self, request) is None:
+            super().check_throttles(request)
+
+
+def idempotent(scope):
+    """ Поддержка заголовка Idempotency-Key для создающих запросов авторизованного пользователя.
+
+    Строка ключа записывается в одной транзакции с действием, поэтому параллельный повтор с тем же ключом ждёт на
+    уникальном индексе фиксации первого запроса и затем получает его ответ, а не выполняет действие второй раз. Если
+    действие завершилось ошибкой, транзакция откатывается вместе с ключом и повтор выполняется заново. Сохраняются
+    только успешные ответы (2xx) """
+
+    def decorator(view_method):
+
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key or not request.user.is_authenticated:
+                return view_method(view, request, *args, **kwargs)
+            if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+                return Response(data={"Idempotency-Key": "Слишком длинный ключ"}, status=HTTP_400_BAD_REQUEST)
+            fingerprint = request_fingerprint(request)
+            record = getattr(request, 'idempotency_record', None)
+            if record is not None:
+                return replay(record, fingerprint)
+            with transaction.atomic():
+                record, created = IdempotencyKey.objects.get_or_create(
+                    user_id=request.user.id, scope=scope, key=key, defaults={'fingerprint': fingerprint}
+                )
+                if not created:
+                    return replay(record, fingerprint)
+                response = view_method(view, request, *args, **kwargs)
+                if response.status_code >= 300:
+                    record.delete()
+                    return response
+                record.status_code = response.status_code
+                record.response = json.loads(json.dumps(response.data, cls=JSONEncoder))
+                record.save(update_fields=['status_code', 'response'])
+            return response
+
+        wrapper.idempotency_scope = scope
+        return wrapper
+
+    return decorator
+
+
+@celery_app.task
+def delete_expired_idempotency_keys():
+    """ Удаление ключей идемпотентности старше IDEMPOTENCY_KEY_TTL секунд """
+    expired = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    IdempotencyKey.objects.filter(created_at__lt=expired).delete()
@@ -0,0 +1,292 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+
+from order_app.cache import bump_catalogue_version
+from order_app.models import Product, Price, Category, ImportJob
+from order_app.search import update_search_vectors
+from order_app.stock import available_stock, reserved_stock
+
+MONEY_STEP = Decimal('0.01')
+# границы BigIntegerField для id товара у поставщика
+EXTERNAL_ID_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def bulk_update_values(objs, fields):
+    """ Обновление объектов одним запросом UPDATE ... FROM (VALUES ...).
+
+    В отличие от QuerySet.bulk_update не строит CASE WHEN на каждую строку, поэтому не тратит время на компиляцию
+    выражений в Python. """
+    if not objs:
+        return
+    meta = objs[0]._meta
+    fields = [meta.pk] + [meta.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    types = [meta.pk.rel_db_type(connection)] + [field.db_type(connection) for field in fields[1:]]
+    row = '({})'.format(', '.join(f'%s::{db_type}' for db_type in types))
+    sql = 'UPDATE {table} SET {columns} FROM (VALUES {rows}) AS v ({names}) WHERE {table}.{pk} = v.{pk}'.format(
+        table=quote(meta.db_table),
+        columns=', '.join(f'{quote(field.column)} = v.{quote(field.column)}' for field in fields[1:]),
+        rows=', '.join([row] * len(objs)),
+        names=', '.join(quote(field.column) for field in fields),
+        pk=quote(meta.pk.column),
+    )
+    params = [field.get_db_prep_save(getattr(obj, field.attname), connection) for obj in objs for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def describe_parameters(parameters):
+    """ Текстовое описание товара из его параметров """
+    return '\n'.join(f'{key}: {value}' for key, value in parameters.items())
+
+
+def fingerprint(item):
+    """ Отпечаток содержимого товара: название, категория, цена, остаток и параметры """
+    content = {key: item.get(key) for key in ('name', 'category', 'price', 'quantity', 'parameters')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def external_id(item):
+    """ id товара у поставщика или None, если его нет или значение не подходит для поля external_id """
+    value = item.get('id') if isinstance(item, dict) else None
+    if isinstance(value, int) and not isinstance(value, bool) and value in EXTERNAL_ID_RANGE:
+        return value
+    return None
+
+
+def money(value):
+    """ Цена из прайс-листа в виде Decimal с точностью до копеек или None, если значение не подходит для поля цены """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        amount = Decimal(str(value)).quantize(MONEY_STEP)
+    except InvalidOperation:
+        return None
+    field = Price._meta.get_field('price')
+    if not amount.is_finite() or amount < 0 or len(amount.as_tuple().digits) > field.max_digits:
+        return None
+    return amount
+
+
+class PriceListImporter:
+    """ Импорт прайс-листа поставщика пачками фиксированного размера.
+
+    Для каждой пачки существующие товары и цены загружаются несколькими запросами, изменения вычисляются в памяти и
+    записываются через bulk_create и UPDATE ... FROM (VALUES ...), поэтому число запросов на пачку не зависит от
+    размера файла. Каждая пачка записывается в своей транзакции, после неё сохраняется прогресс задания импорта.
+    Пачка, запись которой упала с ошибкой базы, записывается заново половинами, поэтому ошибочными считаются только
+    товары, на которых падает запись, а не вся пачка.
+
+    Остаток quantity в прайс-листе - остаток на складе поставщика, в нём ещё учтены товары незавершённых заказов,
+    поэтому у цены сохраняется остаток за вычетом их резерва, и для изменившихся, и для неизменившихся товаров.
+
+    Для товаров с id поставщика хранится отпечаток содержимого: неизменившиеся товары не перезаписываются, а товары,
+    пропавшие из прайса, удаляются из предложений поставщика в finish(). Товар, который есть в прайсе, но не записан
+    из-за ошибки в его полях или отката пачки, пропавшим не считается: его предложение остаётся прежним. """
+
+    def __init__(self, provider, chunk_size=None, job=None):
+        self.provider = provider
+        self.chunk_size = chunk_size or settings.PRICE_LIST_IMPORT_CHUNK_SIZE
+        self.job = job
+        self.category_ids = set()
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.changed = []
+        self.unchanged = []
+        self.removed = []
+        self.seen = set()
+
+    @property
+    def report(self):
+        """ Отчёт об импорте: id поставщика изменённых, неизменившихся и удалённых товаров """
+        return {'changed': self.changed, 'unchanged': self.unchanged, 'removed': self.removed}
+
+    def import_categories(self, categories):
+        """ Создание отсутствующих категорий одним запросом """
+        categories = {data['id']: data['name'] for data in categories}
+        existing = set(Category.objects.filter(id__in=categories).values_list('id', flat=True))
+        missing = [Category(id=category_id, name=name) for category_id, name in categories.items()
+                   if category_id not in existing]
+        if missing:
+            Category.objects.bulk_create(missing, ignore_conflicts=True)
+            bump_catalogue_version()
+        self.category_ids.update(categories)
+
+    def import_goods(self, goods):
+        """ Импорт товаров пачками по chunk_size """
+        goods = iter(goods)
+        while True:
+            chunk = list(islice(goods, self.chunk_size))
+            if not chunk:
+                break
+            self.seen.update(external_id(item) for item in chunk)
+            self.seen.discard(None)
+            self.import_batch(chunk)
+            self.processed += len(chunk)
+            self.save_progress()
+
+    def import_batch(self, goods):
+        """ Запись пачки в своей транзакции. Если запись не удалась, пачка записывается заново половинами, пока
+        ошибочными не останутся только товары, на которых падает запись """
+        counters = self.inserted, self.updated, self.failed, len(self.changed), len(self.unchanged)
+        try:
+            with transaction.atomic():
+                self.import_chunk(goods)
+                if (self.inserted, self.updated) != counters[:2]:
+                    bump_catalogue_version()
+        except DatabaseError:
+            self.inserted, self.updated, self.failed, changed, unchanged = counters
+            del self.changed[changed:], self.unchanged[unchanged:]
+            if len(goods) == 1:
+                self.failed += 1
+            else:
+                middle = len(goods) // 2
+                self.import_batch(goods[:middle])
+                self.import_batch(goods[middle:])
+
+    def finish(self):
+        """ Удаление предложений поставщика, которых нет в загруженном прайсе """
+        removed = [(price_id, external_id) for price_id, external_id in
+                   Price.objects.filter(provider=self.provider, external_id__isnull=False)
+                   .values_list('id', 'external_id').iterator()
+                   if external_id not in self.seen]
+        for start in range(0, len(removed), self.chunk_size):
+            Price.objects.filter(id__in=[price_id for price_id, _ in removed[start:start + self.chunk_size]]).delete()
+        self.removed = [external_id for _, external_id in removed]
+        if removed:
+            bump_catalogue_version()
+        self.save_progress()
+
+    def save_progress(self):
+        """ Сохранение счётчиков в задании импорта """
+        if self.job is not None:
+            ImportJob.objects.filter(id=self.job.id).update(
+                processed=self.processed, inserted=self.inserted, updated=self.updated, failed=self.failed,
+                unchanged=len(self.unchanged), removed=len(self.removed)
+            )
+
+    @staticmethod
+    def is_valid(item):
+        """ Проверка обязательных полей товара """
+        return (isinstance(item, dict)
+                and (item.get('id') is None or external_id(item) is not None)
+                and isinstance(item.get('name'), str)
+                and 0 < len(item['name']) <= Product._meta.get_field('name').max_length
+                and isinstance(item.get('category'), int)
+                and money(item.get('price')) is not None
+                and isinstance(item.get('quantity', 0), int) and item.get('quantity', 0) >= 0
+                and isinstance(item.get('parameters') or {}, dict))
+
+    def import_chunk(self, goods):
+        """ Импорт одной пачки товаров """
+        valid = [item for item in goods if self.is_valid(item)]
+        unknown = {item['category'] for item in valid} - self.category_ids
+        if unknown:
+            self.category_ids.update(Category.objects.filter(id__in=unknown).values_list('id', flat=True))
+        # повторы id поставщика или названия в пачке не записываются и считаются ошибочными товарами
+        known, ids, names = [], set(), set()
+        for item in valid:
+            if item['category'] in self.category_ids and item['name'] not in names and item.get('id') not in ids:
+                known.append(item)
+                names.add(item['name'])
+                if item.get('id') is not None:
+                    ids.add(item['id'])
+        self.failed += len(goods) - len(known)
+
+        hashes = {}
+        for item in known:
+            if item.get('id') is not None:
+                hashes[item['id']] = fingerprint(item)
+        offers = {price.external_id: price
+                  for price in Price.objects.select_for_update(of=('self',))
+                  .filter(provider=self.provider, external_id__in=hashes).annotate(reserved=reserved_stock())}
+        goods = {}
+        restocked = []
+        for item in known:
+            offer = offers.get(item.get('id'))
+            if offer is not None and offer.content_hash == hashes[item['id']]:
+                self.unchanged.append(item['id'])
+                quantity = available_stock(item.get('quantity', 0), offer.reserved)
+                if offer.quantity != quantity:
+                    offer.quantity = quantity
+                    restocked.append(offer)
+            else:
+                goods[item['name']] = item
+        bulk_update_values(restocked, ['quantity'])
+        if not goods:
+            return
+
+        products = {}
+        for product in Product.objects.filter(name__in=goods).order_by('-id'):
+            products[product.name] = product
+        prices = {price.product_id: price
+                  for price in Price.objects.select_for_update(of=('self',))
+                  .filter(provider=self.provider, product__in=products.values()).annotate(reserved=reserved_stock())}
+
+        new_products = []
+        changed_products = []
+        for name, item in goods.items():
+            parameters = item.get('parameters') or {}
+            product = products.get(name)
+            if product is None:
+                product = Product(name=name)
+                products[name] = product
+                new_products.append(product)
+            else:
+                changed_products.append(product)
+            product.category_id = item['category']
+            product.parameters = parameters
+            product.description = describe_parameters(parameters)
+        Product.objects.bulk_create(new_products, batch_size=self.chunk_size)
+        bulk_update_values(changed_products, ['description', 'parameters', 'category'])
+        update_search_vectors([product.id for product in new_products + changed_products])
+
+        # у поставщика одна цена на продукт, поэтому цена товара ищется сначала по продукту и только потом по id
+        # поставщика: при переименовании или обмене названий товары получают цены своих новых продуктов
+        rows = {name: prices[products[name].id] for name in goods if products[name].id in prices}
+        claimed = {price.id for price in rows.values()}
+        for name, item in goods.items():
+            offer = offers.get(item.get('id'))
+            if name not in rows and offer is not None and offer.id not in claimed:
+                rows[name] = offer
+                claimed.add(offer.id)
+        # прежние цены переименованных товаров удаляются, а id поставщика, переходящие к другим ценам, снимаются
+        # до записи, чтобы не нарушить уникальность
+        stale = [offers[item['id']].id for item in goods.values()
+                 if item.get('id') in offers and offers[item['id']].id not in claimed]
+        released = [rows[name].id for name, item in goods.items()
+                    if name in rows and rows[name].external_id not in (None, item.get('id'))]
+        if stale:
+            Price.objects.filter(id__in=stale).delete()
+        if released:
+            Price.objects.filter(id__in=released).update(external_id=None)
+
+        new_prices = []
+        changed_prices = []
+        for name, item in goods.items():
+            product = products[name]
+            price = rows.get(name)
+            if price is None:
+                price = Price(provider=self.provider)
+                new_prices.append(price)
+            else:
+                changed_prices.append(price)
+            price.product = product
+            price.price = money(item['price'])
+            price.quantity = available_stock(item.get('quantity', 0), getattr(price, 'reserved', 0))
+            price.external_id = item.get('id')
+            price.content_hash = hashes.get(item.get('id'), '')
+            if price.external_id is not None:
+                self.changed.append(price.external_id)
+        Price.objects.bulk_create(new_prices, batch_size=self.chunk_size)
+        bulk_update_values(changed_prices, ['product', 'price', 'quantity', 'external_id', 'content_hash'])
+
+        self.inserted += len(new_prices)
+        self.updated += len(changed_prices)
@@ -0,0 +1,185 @@
+import logging
+import os
+import queue
+import smtplib
+import socket
+import ssl
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, socket.timeout, ConnectionError)
+
+
+def is_transient(error):
+    """ Временная ли ошибка SMTP: обрыв соединения или ответ сервера 4xx """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 400 <= error.smtp_code < 500
+
+
+class SMTPPool:
+    """ Пул авторизованных SMTP-соединений процесса.
+
+    Соединение открывается, переводится в TLS и авторизуется один раз и затем переиспользуется задачами процесса.
+    Перед выдачей давно простаивавшее соединение проверяется командой NOOP, после max_messages писем соединение
+    закрывается, чтобы не упереться в ограничения почтового сервера на одну сессию. Письма пачки отправляются
+    по одному соединению, при временных ошибках письмо повторяется на новом соединении с экспоненциальной задержкой. """
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True, size=2, timeout=10, max_idle=30,
+                 max_messages=100, retries=3, backoff=0.5):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.retries = retries
+        self.backoff = backoff
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            host=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            username=settings.EMAIL_HOST_USER,
+            password=settings.EMAIL_HOST_PASSWORD,
+            use_tls=settings.EMAIL_USE_TLS,
+            size=settings.SMTP_POOL_SIZE,
+            timeout=settings.EMAIL_TIMEOUT,
+            max_idle=settings.SMTP_POOL_MAX_IDLE,
+            max_messages=settings.SMTP_POOL_MAX_MESSAGES,
+            retries=settings.SMTP_RETRIES,
+            backoff=settings.SMTP_RETRY_BACKOFF,
+        )
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            self._close(smtp)
+            raise
+        smtp.last_used = time.monotonic()
+        smtp.sent = 0
+        self.connections_opened += 1
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _healthy(self, smtp):
+        """ Проверка соединения командой NOOP, если оно простаивало дольше max_idle секунд """
+        if time.monotonic() - smtp.last_used < self.max_idle:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self):
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            if self._healthy(smtp):
+                return smtp
+            smtp.close()
+
+    def _release(self, smtp):
+        if smtp is None:
+            return
+        if smtp.sent >= self.max_messages:
+            self._close(smtp)
+        else:
+            smtp.last_used = time.monotonic()
+            self._idle.put(smtp)
+
+    def send_messages(self, messages):
+        """ Отправка пачки писем по одному соединению из пула. Возвращает число отправленных писем; письма, которые
+        сервер отклонил окончательно или не принял после всех повторов, записываются в лог и пропускаются """
+        return sum(self.deliver(messages))
+
+    def deliver(self, messages):
+        """ Отправка пачки писем как в send_messages, возвращает для каждого письма, отправлено ли оно """
+        delivered = []
+        with self._slots:
+            smtp = None
+            try:
+                for message in messages:
+                    smtp, sent = self._send(smtp, message)
+                    delivered.append(bool(sent))
+            finally:
+                self._release(smtp)
+        return delivered
+
+    def _send(self, smtp, message):
+        for attempt in range(self.retries + 1):
+            try:
+                if smtp is None:
+                    smtp = self._acquire()
+                elif smtp.sent >= self.max_messages:
+                    self._close(smtp)
+                    smtp = self._acquire()
+                smtp.send_message(message)
+                smtp.sent += 1
+                return smtp, 1
+            except (smtplib.SMTPException, OSError) as error:
+                if smtp is not None and not isinstance(error, smtplib.SMTPRecipientsRefused):
+                    smtp.close()
+                    smtp = None
+                if not is_transient(error) or attempt == self.retries:
+                    logger.error("Письмо %s не отправлено: %s", message["Subject"], error)
+                    return smtp, 0
+                time.sleep(self.backoff * 2 ** attempt)
+        return smtp, 0
+
+    def close(self):
+        """ Закрытие всех простаивающих соединений """
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Пул текущего процесса. После fork воркера celery создаётся новый пул: сокеты родителя не переиспользуются """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = SMTPPool.from_settings()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def send_messages(messages):
+    """ Отправка писем через пул соединений текущего процесса """
+    return get_pool().send_messages(messages)
+
+
+def deliver(messages):
+    """ Отправка писем через пул соединений текущего процесса с результатом по каждому письму """
+    return get_pool().deliver(messages)
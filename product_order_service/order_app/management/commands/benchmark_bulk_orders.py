@@ -0,0 +1,71 @@
+import time
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from order_app.bulk_orders import BulkOrderCreator
+from order_app.management.commands.benchmark_import import Rollback
+from order_app.models import Category, Price, Product
+from order_app.serializers import OrderSerializer
+
+
+class QueryCounter:
+    """ Счётчик запросов к базе без хранения их текста (CaptureQueriesContext хранит не больше 9000 запросов) """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Замер создания заказов (заказов в секунду): по одному заказу через OrderSerializer против пакетного ' \
+           'создания BulkOrderCreator (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--positions', type=int, default=3)
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                buyer = User.objects.create_user(username='benchmark_buyer')
+                provider = User.objects.create_user(username='benchmark_provider', is_staff=True)
+                category = Category.objects.create(name='Категория')
+                products = [Product.objects.create(name=f'Товар {number}', category=category)
+                            for number in range(options['positions'])]
+                prices = [Price.objects.create(product=product, provider=provider, price=100,
+                                               quantity=options['orders'] * 2) for product in products]
+                orders = [{"products_list": [{"product": price.product_id, "provider": provider.id, "quantity": 1}
+                                             for price in prices]} for _ in range(options['orders'])]
+                request = SimpleNamespace(user=buyer)
+
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries):
+                    started = time.perf_counter()
+                    for data in orders:
+                        serializer = OrderSerializer(data=data, context={'request': request})
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                    self.report('по одному', len(orders), time.perf_counter() - started, queries.count)
+
+                creator = BulkOrderCreator(buyer, chunk_size=options['chunk_size'])
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries):
+                    started = time.perf_counter()
+                    results = creator.create(orders)
+                    created = sum('id' in result for result in results)
+                    self.report(f'пачкой по {creator.chunk_size}', created, time.perf_counter() - started,
+                                queries.count)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, name, count, elapsed, queries):
+        self.stdout.write(f'{name}: заказов {count}, запросов {queries}, время {elapsed:.2f} с, '
+                          f'{count / elapsed:.0f} заказов/с')
@@ -0,0 +1,47 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from order_app.importer import PriceListImporter
+
+
+class Rollback(Exception):
+    """ Откат данных, созданных замером """
+
+
+def generate_goods(count, price=100, category=1):
+    """ Генерация тестовых товаров в формате прайс-листа """
+    return [{'id': number, 'category': category, 'name': f'Товар {number}', 'price': price, 'quantity': 10,
+             'parameters': {'Цвет': 'черный', 'Номер': number}} for number in range(count)]
+
+
+class Command(BaseCommand):
+    help = 'Замер числа запросов и времени импорта прайс-листа (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=10000)
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                provider = User.objects.create_user(username='benchmark_provider', is_staff=True)
+                categories = [{'id': 1, 'name': 'Категория'}]
+                for run, price in (('insert', 100), ('update', 200), ('unchanged', 200)):
+                    importer = PriceListImporter(provider, chunk_size=options['chunk_size'])
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        importer.import_categories(categories)
+                        importer.import_goods(generate_goods(options['goods'], price=price))
+                        importer.finish()
+                        elapsed = time.perf_counter() - started
+                    per_10k = 10000 / importer.processed
+                    self.stdout.write(f'{run}: товаров {importer.processed}, запросов {len(queries)}, '
+                                      f'время {elapsed:.2f} с; на 10k товаров: запросов {len(queries) * per_10k:.0f}, '
+                                      f'время {elapsed * per_10k:.2f} с')
+                raise Rollback
+        except Rollback:
+            pass
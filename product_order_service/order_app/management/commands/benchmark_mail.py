@@ -0,0 +1,106 @@
+import logging
+import smtplib
+import socket
+import time
+from email.message import EmailMessage
+
+from django.core.management.base import BaseCommand
+
+from order_app.mail import SMTPPool
+
+
+class LocalSMTPServer:
+    """ Локальный SMTP-сервер на aiosmtpd для тестов и замеров: принимает письма в память, считает подключения
+    и авторизации, может отвечать временной ошибкой 451 на первые fail_first писем """
+
+    def __init__(self, fail_first=0):
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+
+        self.messages = []
+        self.logins = 0
+        self.connections = 0
+        self.fail_first = fail_first
+        self.port = free_port()
+        server = self
+
+        class Handler:
+            async def handle_EHLO(self, smtp, session, envelope, hostname, responses):
+                server.connections += 1
+                session.host_name = hostname
+                return responses
+
+            async def handle_DATA(self, smtp, session, envelope):
+                if server.fail_first > 0:
+                    server.fail_first -= 1
+                    return '451 Try again later'
+                server.messages.append(envelope.content)
+                return '250 OK'
+
+        def authenticator(smtp, session, envelope, mechanism, auth_data):
+            server.logins += 1
+            return AuthResult(success=True)
+
+        logging.getLogger('mail.log').setLevel(logging.ERROR)
+        self.controller = Controller(Handler(), hostname='127.0.0.1', port=self.port, authenticator=authenticator,
+                                     auth_require_tls=False)
+
+    def __enter__(self):
+        self.controller.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.controller.stop()
+
+    def pool(self, **options):
+        """ Пул соединений с этим сервером """
+        options.setdefault('username', 'shop')
+        options.setdefault('password', 'secret')
+        return SMTPPool('127.0.0.1', self.port, use_tls=False, **options)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_message(number):
+    message = EmailMessage()
+    message["From"] = 'shop@example.com'
+    message["To"] = f'buyer{number}@example.com'
+    message["Subject"] = f"Подтверждение заказа {number}"
+    message.set_content(f"Ваш заказ №: {number} принят")
+    return message
+
+
+class Command(BaseCommand):
+    help = 'Замер скорости отправки писем (писем в секунду) на локальный SMTP-сервер: отдельное соединение на ' \
+           'каждое письмо против пула соединений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--batch', type=int, default=50)
+
+    def handle(self, *args, **options):
+        messages = [make_message(number) for number in range(options['messages'])]
+        with LocalSMTPServer() as server:
+            started = time.perf_counter()
+            for message in messages:
+                with smtplib.SMTP('127.0.0.1', server.port) as smtp:
+                    smtp.login('shop', 'secret')
+                    smtp.send_message(message)
+            self.report('соединение на письмо', len(messages), time.perf_counter() - started)
+
+            pool = server.pool()
+            started = time.perf_counter()
+            for start in range(0, len(messages), options['batch']):
+                pool.send_messages(messages[start:start + options['batch']])
+            self.report(f'пул, пачки по {options["batch"]}', len(messages), time.perf_counter() - started,
+                        pool.connections_opened)
+            pool.close()
+
+    def report(self, name, count, elapsed, connections=None):
+        connections = count if connections is None else connections
+        self.stdout.write(f'{name}: писем {count}, соединений {connections}, время {elapsed:.2f} с, '
+                          f'{count / elapsed:.0f} писем/с')
@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from order_app.management.commands.benchmark_import import Rollback
+from order_app.management.commands.benchmark_mail import LocalSMTPServer
+from order_app.models import Category, Notification, NotificationKindChoices, Order, Position, Price, Product
+from order_app.notifications import load_pending, render_pending
+
+
+def create_confirmations(count, positions=3):
+    """ Генерация заказов с позициями и уведомлений о подтверждении заказа, у каждого заказа свой покупатель """
+    buyers = User.objects.bulk_create([User(username=f'benchmark_buyer_{number}', email=f'buyer{number}@example.com')
+                                       for number in range(count)])
+    provider = User.objects.create_user(username='benchmark_provider', email='provider@example.com', is_staff=True)
+    category = Category.objects.create(name='Категория')
+    prices = [Price.objects.create(product=Product.objects.create(name=f'Товар {number}', category=category),
+                                   provider=provider, price=100, quantity=count)
+              for number in range(positions)]
+    orders = Order.objects.bulk_create([Order(user=buyer, count=positions, total=100 * positions)
+                                        for buyer in buyers])
+    Position.objects.bulk_create([Position(order=order, product_id=price.product_id, provider=provider, quantity=1,
+                                           price=price.price, total=price.price)
+                                  for order in orders for price in prices])
+    Notification.objects.bulk_create([Notification(recipient=order.user, kind=NotificationKindChoices.ORDER_CONFIRMED,
+                                                   order=order) for order in orders])
+
+
+class Command(BaseCommand):
+    help = 'Замер отправки писем о подтверждении заказа пачками: время загрузки данных (и число запросов), ' \
+           'отрисовки шаблонов и отправки на локальный SMTP-сервер (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--positions', type=int, default=3)
+
+    def handle(self, *args, **options):
+        load = render = send = 0.0
+        queries_count = sent = 0
+        try:
+            with transaction.atomic(), LocalSMTPServer() as server:
+                create_confirmations(options['orders'], options['positions'])
+                pool = server.pool()
+                last_id = 0
+                while True:
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        notifications = load_pending(Notification.objects.filter(id__gt=last_id))
+                        load += time.perf_counter() - started
+                    queries_count += len(queries)
+                    if not notifications:
+                        break
+                    last_id = notifications[-1].id
+                    started = time.perf_counter()
+                    messages, groups, skipped = render_pending(notifications)
+                    render += time.perf_counter() - started
+                    started = time.perf_counter()
+                    sent += sum(pool.deliver(messages))
+                    send += time.perf_counter() - started
+                pool.close()
+                raise Rollback
+        except Rollback:
+            pass
+        total = load + render + send
+        self.stdout.write(f'писем {sent}, время {total:.2f} с, {sent / total:.0f} писем/с')
+        for name, elapsed in (('загрузка', load), ('отрисовка', render), ('отправка', send)):
+            self.stdout.write(f'{name}: {elapsed:.2f} с ({elapsed / total:.0%})')
+        self.stdout.write(f'запросов на загрузку: {queries_count}')
@@ -0,0 +1,131 @@
+import asyncio
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.authtoken.models import Token
+
+from order_app.management.commands.benchmark_mail import free_port
+
+
+class ServerProcess:
+    """ Сервер uvicorn с приложением проекта в отдельном процессе: interface='asgi' - product_order_service.asgi,
+    interface='wsgi' - product_order_service.wsgi, запросы которого выполняются в пуле потоков, как в многопоточном
+    WSGI-сервере """
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.port = free_port()
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', f'product_order_service.{self.interface}:application',
+             '--interface', 'asgi3' if self.interface == 'asgi' else 'wsgi', '--port', str(self.port),
+             '--log-level', 'warning', '--no-access-log'],
+            cwd=settings.BASE_DIR,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.process.kill()
+        raise CommandError(f'Сервер {self.interface} не запустился')
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+
+    def peak_memory(self):
+        """ Пиковый объём памяти процесса сервера (VmHWM) в МБ или None, если /proc недоступен """
+        try:
+            with open(f'/proc/{self.process.pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+
+
+async def fetch(port, path, token):
+    """ Один GET запрос по отдельному соединению: код ответа и время в секундах """
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    headers = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n'
+    if token:
+        headers += f'Authorization: Token {token}\r\n'
+    writer.write((headers + '\r\n').encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1]), time.perf_counter() - started
+
+
+async def load(port, path, token, concurrency, requests):
+    """ requests запросов, не больше concurrency одновременно """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            try:
+                return await fetch(port, path, token)
+            except OSError:
+                return None, None
+
+    return await asyncio.gather(*[limited() for _ in range(requests)])
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест чтения под WSGI и ASGI (uvicorn): задержка ответов, запросов в секунду и пиковая ' \
+           'память процесса сервера при concurrency одновременных соединениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--wsgi-path', default='/api/v1/products/')
+        parser.add_argument('--asgi-path', default='/api/v1/async/products/')
+        parser.add_argument('--token', default=None,
+                            help='токен пользователя; без него запросы идут от временного пользователя, чтобы не '
+                                 'упереться в ограничение anon')
+
+    def handle(self, *args, **options):
+        user = None
+        token = options['token']
+        if token is None:
+            user = User.objects.create_user(username=f'load_test_{free_port()}')
+            token = Token.objects.create(user=user).key
+        try:
+            for interface, path in (('wsgi', options['wsgi_path']), ('asgi', options['asgi_path'])):
+                with ServerProcess(interface) as server:
+                    started = time.perf_counter()
+                    results = asyncio.run(load(server.port, path, token, options['concurrency'],
+                                               options['requests']))
+                    elapsed = time.perf_counter() - started
+                    memory = server.peak_memory()
+                self.report(interface, path, results, elapsed, memory)
+        finally:
+            if user is not None:
+                user.delete()
+
+    def report(self, interface, path, results, elapsed, memory):
+        latencies = sorted(latency for status, latency in results if status == 200)
+        errors = len(results) - len(latencies)
+        if not latencies:
+            self.stdout.write(f'{interface} {path}: нет успешных ответов, ошибок {errors}')
+            return
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        memory = f'{memory:.0f} МБ' if memory is not None else 'нет данных'
+        self.stdout.write(f'{interface} {path}: ответов {len(latencies)}, ошибок {errors}, '
+                          f'{len(latencies) / elapsed:.0f} запросов/с, задержка p50 {percentiles[49] * 1000:.0f} мс, '
+                          f'p95 {percentiles[94] * 1000:.0f} мс, p99 {percentiles[98] * 1000:.0f} мс, '
+                          f'память {memory}')
@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from order_app.analytics import rebuild_sales_summary
+
+
+class Command(BaseCommand):
+    help = 'Пересборка сводок продаж по всем заказам'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        products, providers = rebuild_sales_summary()
+        self.stdout.write(f'Строк по товарам: {products}, по поставщикам: {providers}, '
+                          f'время {time.perf_counter() - started:.2f} с')
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_app', '0016_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='removed',
+            field=models.PositiveIntegerField(default=0, verbose_name='Удалено'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='report',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Отчёт'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged',
+            field=models.PositiveIntegerField(default=0, verbose_name='Без изменений'),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40, verbose_name='Отпечаток содержимого'),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='external_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='id товара у поставщика'),
+        ),
+        migrations.AddConstraint(
+            model_name='price',
+            constraint=models.UniqueConstraint(fields=('provider', 'external_id'), name='unique_provider_external_id'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:24
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    """ Триграммный индекс по названию, если в базе доступно расширение pg_trgm """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+        if not cursor.fetchone()[0]:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON order_app_product '
+                          'USING gin (name gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm_idx')
+
+
+def fill_search_vector(apps, schema_editor):
+    """ Заполнение поискового вектора у существующих товаров """
+    schema_editor.execute(
+        "UPDATE order_app_product SET search_vector = "
+        "setweight(to_tsvector('russian'::regconfig, COALESCE(name, '')), 'A') || "
+        "setweight(to_tsvector('russian'::regconfig, COALESCE(description, '')), 'B')"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_app', '0017_price_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
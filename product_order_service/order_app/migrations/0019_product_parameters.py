@@ -0,0 +1,75 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:26
+
+import ast
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+
+def describe(parameters):
+    return '\n'.join(f'{key}: {value}' for key, value in parameters.items())
+
+
+def parse_description(description):
+    """ Разбор описания, сохранённого импортом как строка со списком словарей """
+    try:
+        items = ast.literal_eval(description)
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return None
+    parameters = {}
+    for item in items:
+        parameters.update(item)
+    return parameters
+
+
+def convert_descriptions(apps, schema_editor):
+    """ Перенос параметров из строкового описания в поле parameters пачками по BATCH_SIZE товаров """
+    Product = apps.get_model('order_app', 'Product')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Product.objects.filter(id__gt=last_id, description__startswith='[')
+                         .order_by('id').only('id', 'description')[:BATCH_SIZE])
+            if not batch:
+                break
+            changed = []
+            for product in batch:
+                parameters = parse_description(product.description)
+                if parameters is not None:
+                    product.parameters = parameters
+                    product.description = describe(parameters)
+                    changed.append(product)
+            Product.objects.bulk_update(changed, ['parameters', 'description'])
+            schema_editor.execute(
+                "UPDATE order_app_product SET search_vector = "
+                "setweight(to_tsvector('russian'::regconfig, COALESCE(name, '')), 'A') || "
+                "setweight(to_tsvector('russian'::regconfig, COALESCE(description, '')), 'B') "
+                "WHERE id = ANY(%s)", params=[[product.id for product in changed]]
+            )
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('order_app', '0018_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Параметры'),
+        ),
+        migrations.RunPython(convert_descriptions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['parameters'], name='product_parameters_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:30
+
+from django.db import migrations, models, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def fill_position_totals(apps, schema_editor):
+    """ Заполнение цены и суммы уже созданных позиций пачками по BATCH_SIZE позиций. Цена на момент заказа не
+    сохранялась, поэтому берётся текущая цена поставщика """
+    Position = apps.get_model('order_app', 'Position')
+    Price = apps.get_model('order_app', 'Price')
+    price = Price.objects.filter(product=OuterRef('product'), provider=OuterRef('provider')).order_by('id')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Position.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+            if not ids:
+                break
+            batch = Position.objects.filter(id__in=ids)
+            batch.update(price=Coalesce(Subquery(price.values('price')[:1]), Value(0), output_field=models.DecimalField()))
+            batch.update(total=F('price') * F('quantity'))
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('order_app', '0019_product_parameters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='position',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Цена за единицу'),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Сумма'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='price',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Цена'),
+        ),
+        migrations.RunPython(fill_position_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_app', '0020_decimal_money'),
+    ]
+
+    # у существующих цен остаток неизвестен: NULL (не учитывается) до следующего импорта прайс-листа поставщиком,
+    # иначе сразу после миграции их нельзя было бы заказать
+    operations = [
+        migrations.AddField(
+            model_name='price',
+            name='quantity',
+            field=models.PositiveIntegerField(null=True, verbose_name='Остаток на складе'),
+        ),
+        migrations.AlterField(
+            model_name='price',
+            name='quantity',
+            field=models.PositiveIntegerField(default=0, null=True, verbose_name='Остаток на складе'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:35
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models, transaction
+from django.db.models import Count, Max
+
+
+def remove_duplicate_prices(apps, schema_editor):
+    """ Удаление повторных цен поставщика на один товар перед созданием уникального ограничения, остаётся последняя
+    загруженная цена """
+    Price = apps.get_model('order_app', 'Price')
+    duplicates = Price.objects.values('product', 'provider').annotate(count=Count('id'), last_id=Max('id')).filter(
+        count__gt=1
+    )
+    with transaction.atomic():
+        for row in duplicates:
+            Price.objects.filter(product=row['product'], provider=row['provider']).exclude(id=row['last_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('order_app', '0021_price_quantity'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='position',
+            index=models.Index(fields=['provider', 'order'], name='position_provider_order_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['name'], name='product_name_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_prices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='price',
+            constraint=models.UniqueConstraint(fields=('product', 'provider'), name='unique_product_provider'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('order_app', '0022_hot_path_indexes'),
+    ]
+
+    operations = [
+        # дата существующих заказов неизвестна: NULL, а не дата миграции, иначе все прошлые продажи попали бы в
+        # сводку за день миграции
+        migrations.AddField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(null=True, verbose_name='Создан'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True, verbose_name='Создан'),
+        ),
+        migrations.CreateModel(
+            name='SalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('units', models.BigIntegerField(default=0, verbose_name='Продано единиц')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов с товаром')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='order_app.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='order_app.product', verbose_name='Товар')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to=settings.AUTH_USER_MODEL, verbose_name='Поставщик')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProviderSalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('units', models.BigIntegerField(default=0, verbose_name='Продано единиц')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to=settings.AUTH_USER_MODEL, verbose_name='Поставщик')),
+            ],
+            options={
+                'verbose_name': 'Продажи поставщика за день',
+                'verbose_name_plural': 'Продажи поставщиков по дням',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='salessummary',
+            index=models.Index(fields=['provider', 'day'], name='sales_provider_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='salessummary',
+            constraint=models.UniqueConstraint(fields=('provider', 'product', 'day'), name='unique_sales_provider_product_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='providersalessummary',
+            constraint=models.UniqueConstraint(fields=('provider', 'day'), name='unique_sales_provider_day'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.7 on 2026-10-18 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_app', '0024_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(choices=[('NEW_ORDER', 'Новый заказ'), ('ORDER_CANCELLED', 'Заказ отменён'), ('REGISTERED', 'Регистрация'), ('ORDER_CONFIRMED', 'Подтверждение заказа'), ('STATUS_CHANGED', 'Статус заказа изменён')], max_length=20, verbose_name='Событие'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='order_app.order', verbose_name='Заказ'),
+        ),
+    ]
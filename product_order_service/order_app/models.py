@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 
 class OrderStatusChoices(models.TextChoices):
@@ -11,12 +13,43 @@ class OrderStatusChoices(models.TextChoices):
     CANCELLED = "CANCELLED", "Отменён"
 
 
+class ImportStatusChoices(models.TextChoices):
+    """Статусы импорта прайс-листа"""
+
+    PENDING = "PENDING", "В очереди"
+    RUNNING = "RUNNING", "Выполняется"
+    DONE = "DONE", "Завершён"
+    FAILED = "FAILED", "Ошибка"
+
+
+class NotificationKindChoices(models.TextChoices):
+    """ События, о которых пользователям отправляются письма """
+
+    NEW_ORDER = "NEW_ORDER", "Новый заказ"
+    ORDER_CANCELLED = "ORDER_CANCELLED", "Заказ отменён"
+    REGISTERED = "REGISTERED", "Регистрация"
+    ORDER_CONFIRMED = "ORDER_CONFIRMED", "Подтверждение заказа"
+    STATUS_CHANGED = "STATUS_CHANGED", "Статус заказа изменён"
+
+
+class DeliveryChoices(models.TextChoices):
+    """ Способ доставки уведомлений """
+
+    IMMEDIATE = "IMMEDIATE", "Сразу"
+    DIGEST = "DIGEST", "Сводкой"
+
+
 class Price(models.Model):
     """ Цены на продукты от разных поставщиков """
 
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='price')
     provider = models.ForeignKey(User, on_delete=models.CASCADE, related_name='price')
-    price = models.FloatField("Цена", default=0.00)
+    price = models.DecimalField("Цена", max_digits=12, decimal_places=2, default=0)
+    # доступный остаток: остаток поставщика из прайс-листа за вычетом резервов незавершённых заказов; NULL - остаток
+    # не учитывается (цены, загруженные до появления остатков)
+    quantity = models.PositiveIntegerField("Остаток на складе", default=0, null=True)
+    external_id = models.BigIntegerField("id товара у поставщика", null=True, blank=True)
+    content_hash = models.CharField("Отпечаток содержимого", max_length=40, blank=True, default='')
 
     def __str__(self):
         return "Цена на {} {} в {}(ом; е).".format(self.product.name, self.price, self.provider.username)
@@ -24,6 +57,10 @@ class Price(models.Model):
     class Meta:
         verbose_name = "Наименование"
         verbose_name_plural = "Наименования"
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'external_id'], name='unique_provider_external_id'),
+            models.UniqueConstraint(fields=['product', 'provider'], name='unique_product_provider'),
+        ]
 
 
 class Product(models.Model):
@@ -31,9 +68,11 @@ class Product(models.Model):
 
     name = models.CharField("Название", max_length=50)
     description = models.TextField("Описание", default='')
+    parameters = models.JSONField("Параметры", default=dict, blank=True)
     category = models.ForeignKey('Category', verbose_name='Категория', related_name='products', blank=True,
                                  on_delete=models.CASCADE)
     providers_info = models.ManyToManyField(User, related_name='products', through="Price")
+    search_vector = SearchVectorField("Поисковый вектор", null=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -41,6 +80,11 @@ class Product(models.Model):
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(fields=['parameters'], name='product_parameters_idx'),
+            models.Index(fields=['name'], name='product_name_idx'),
+        ]
 
 
 class Category(models.Model):
@@ -72,7 +116,9 @@ class Order(models.Model):
     )
     products_list = models.ManyToManyField(Product, related_name='order', through='Position')
     count = models.PositiveIntegerField(editable=False)
-    total = models.FloatField(editable=False)
+    total = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    # у заказов, созданных до появления поля, дата неизвестна (NULL), в сводки продаж они не входят
+    created_at = models.DateTimeField("Создан", auto_now_add=True, null=True)
 
     def __str__(self):
         return "User: У пользователя {} {} единиц товара в заказе на сумму {}".format(self.user, self.count, self.total)
@@ -80,6 +126,9 @@ class Order(models.Model):
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
+        indexes = [
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ]
 
 
 class Position(models.Model):
@@ -89,6 +138,8 @@ class Position(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='position')
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='position')
     quantity = models.PositiveIntegerField()
+    price = models.DecimalField("Цена за единицу", max_digits=12, decimal_places=2, default=0, editable=False)
+    total = models.DecimalField("Сумма", max_digits=12, decimal_places=2, default=0, editable=False)
 
     def __str__(self):
         return "Позиция содержит {} {}(шт).".format(self.quantity, self.product.name)
@@ -96,3 +147,143 @@ class Position(models.Model):
     class Meta:
         verbose_name = "Наименование"
         verbose_name_plural = "Наименования"
+        indexes = [
+            models.Index(fields=['provider', 'order'], name='position_provider_order_idx'),
+        ]
+
+
+class ImportJob(models.Model):
+    """ Задание на импорт прайс-листа """
+
+    provider = models.ForeignKey(User, verbose_name="Поставщик", on_delete=models.CASCADE, related_name='import_jobs')
+    file = models.FileField("Файл", upload_to='imports/')
+    status = models.CharField("Статус", max_length=20, choices=ImportStatusChoices.choices,
+                              default=ImportStatusChoices.PENDING)
+    processed = models.PositiveIntegerField("Обработано", default=0)
+    inserted = models.PositiveIntegerField("Добавлено", default=0)
+    updated = models.PositiveIntegerField("Обновлено", default=0)
+    failed = models.PositiveIntegerField("С ошибками", default=0)
+    unchanged = models.PositiveIntegerField("Без изменений", default=0)
+    removed = models.PositiveIntegerField("Удалено", default=0)
+    report = models.JSONField("Отчёт", default=dict, blank=True)
+    error = models.TextField("Ошибка", blank=True, default='')
+    created_at = models.DateTimeField("Создан", auto_now_add=True)
+    started_at = models.DateTimeField("Начат", null=True, blank=True)
+    finished_at = models.DateTimeField("Завершён", null=True, blank=True)
+
+    def __str__(self):
+        return "Импорт {} от {}: {}".format(self.file.name, self.provider, self.status)
+
+    class Meta:
+        verbose_name = "Импорт прайс-листа"
+        verbose_name_plural = "Импорт прайс-листов"
+
+
+class SalesSummary(models.Model):
+    """ Продажи поставщика по товару за день: пополняется при создании и смене статуса заказов, пересобирается
+    командой rebuild_sales_summary """
+
+    provider = models.ForeignKey(User, verbose_name="Поставщик", on_delete=models.CASCADE, related_name='sales')
+    product = models.ForeignKey(Product, verbose_name="Товар", on_delete=models.CASCADE, related_name='sales')
+    category = models.ForeignKey(Category, verbose_name="Категория", on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='sales')
+    day = models.DateField("День")
+    units = models.BigIntegerField("Продано единиц", default=0)
+    revenue = models.DecimalField("Выручка", max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField("Заказов с товаром", default=0)
+
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'product', 'day'], name='unique_sales_provider_product_day'),
+        ]
+        indexes = [
+            models.Index(fields=['provider', 'day'], name='sales_provider_day_idx'),
+        ]
+
+
+class ProviderSalesSummary(models.Model):
+    """ Продажи поставщика за день. Хранится отдельно от продаж по товарам, потому что заказ с несколькими товарами
+    поставщика считается здесь один раз """
+
+    provider = models.ForeignKey(User, verbose_name="Поставщик", on_delete=models.CASCADE,
+                                 related_name='daily_sales')
+    day = models.DateField("День")
+    units = models.BigIntegerField("Продано единиц", default=0)
+    revenue = models.DecimalField("Выручка", max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField("Заказов", default=0)
+
+    class Meta:
+        verbose_name = "Продажи поставщика за день"
+        verbose_name_plural = "Продажи поставщиков по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'day'], name='unique_sales_provider_day'),
+        ]
+
+
+class Notification(models.Model):
+    """ Письмо пользователю о событии в очереди на отправку (outbox): записывается в транзакции события и
+    отправляется только после её фиксации """
+
+    recipient = models.ForeignKey(User, verbose_name="Получатель", on_delete=models.CASCADE,
+                                  related_name='notifications')
+    kind = models.CharField("Событие", max_length=20, choices=NotificationKindChoices.choices)
+    order = models.ForeignKey(Order, verbose_name="Заказ", on_delete=models.CASCADE, null=True, blank=True,
+                              related_name='notifications')
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    claimed_at = models.DateTimeField("Взято на отправку", null=True, blank=True)
+    sent_at = models.DateTimeField("Отправлено", null=True, blank=True)
+
+    def __str__(self):
+        if self.order_id is None:
+            return "{} для {}".format(self.get_kind_display(), self.recipient)
+        return "{} №{} для {}".format(self.get_kind_display(), self.order_id, self.recipient)
+
+    class Meta:
+        verbose_name = "Уведомление"
+        verbose_name_plural = "Уведомления"
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(sent_at__isnull=True),
+                         name='notification_pending_idx'),
+        ]
+
+
+class NotificationPreference(models.Model):
+    """ Настройка доставки уведомлений пользователя: сразу или сводкой раз в NOTIFICATION_DIGEST_WINDOW секунд """
+
+    user = models.OneToOneField(User, verbose_name="Пользователь", on_delete=models.CASCADE,
+                                related_name='notification_preference')
+    delivery = models.CharField("Доставка", max_length=20, choices=DeliveryChoices.choices,
+                                default=DeliveryChoices.DIGEST)
+
+    def __str__(self):
+        return "{}: {}".format(self.user, self.get_delivery_display())
+
+    class Meta:
+        verbose_name = "Настройка уведомлений"
+        verbose_name_plural = "Настройки уведомлений"
+
+
+class IdempotencyKey(models.Model):
+    """ Ответ на запрос с заголовком Idempotency-Key: повтор запроса с тем же ключом получает сохранённый ответ, а не
+    выполняется заново. Записи старше IDEMPOTENCY_KEY_TTL секунд удаляются задачей delete_expired_idempotency_keys """
+
+    user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.CASCADE,
+                             related_name='idempotency_keys')
+    scope = models.CharField("Действие", max_length=40)
+    key = models.CharField("Ключ", max_length=255)
+    fingerprint = models.CharField("Отпечаток запроса", max_length=64)
+    status_code = models.PositiveSmallIntegerField("Код ответа", null=True)
+    response = models.JSONField("Ответ", null=True)
+    created_at = models.DateTimeField("Создан", auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return "{} {} {}".format(self.user, self.scope, self.key)
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
@@ -0,0 +1,153 @@
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.utils import timezone
+
+from order_app.email_sender import DIGEST_KINDS, GROUPED_MESSAGES, MESSAGES, provider_digest
+from order_app.mail import deliver
+from order_app.models import DeliveryChoices, Notification, NotificationPreference, Position
+from product_order_service import celery_app
+
+_outbox = threading.local()
+
+
+def schedule_delivery(notification_ids):
+    """ Отправка уведомлений после фиксации текущей транзакции. Уведомления всех событий транзакции уходят в брокер
+    пачками по NOTIFICATION_BATCH_SIZE id, поэтому воркер не может прочитать незафиксированные строки, а в брокер
+    попадает одна маленькая задача на транзакцию вместо задачи на каждое письмо """
+    if not notification_ids:
+        return
+    if not hasattr(_outbox, 'ids'):
+        _outbox.ids = []
+    _outbox.ids.extend(notification_ids)
+    transaction.on_commit(flush_outbox)
+
+
+def flush_outbox():
+    """ Постановка в очередь уведомлений, накопленных зафиксированными транзакциями потока. id уведомлений
+    откаченных транзакций при этом игнорируются задачей: их строк в базе нет """
+    ids, _outbox.ids = getattr(_outbox, 'ids', []), []
+    for start in range(0, len(ids), settings.NOTIFICATION_BATCH_SIZE):
+        send_notifications.delay(ids[start:start + settings.NOTIFICATION_BATCH_SIZE])
+
+
+def notify(recipient, kind, order=None):
+    """ Запись письма пользователю в outbox в текущей транзакции с отправкой после её фиксации """
+    notification = Notification.objects.create(recipient=recipient, kind=kind, order=order)
+    schedule_delivery([notification.id])
+
+
+def notify_orders(recipient, kind, orders):
+    """ Запись писем пользователю о нескольких заказах в outbox в текущей транзакции. Уведомления одной пачки
+    отправляются получателю одним письмом """
+    notifications = Notification.objects.bulk_create(
+        [Notification(recipient=recipient, kind=kind, order=order) for order in orders]
+    )
+    schedule_delivery([notification.id for notification in notifications])
+
+
+def notify_providers(orders, kind):
+    """ Запись уведомлений поставщиков заказов в outbox в текущей транзакции. Уведомления получателей с доставкой
+    "сразу" отправляются после фиксации транзакции одним письмом на поставщика, остальные - сводкой задачей
+    send_notification_digests """
+    pairs = sorted(set(Position.objects.filter(order__in=orders).values_list('provider_id', 'order_id')))
+    notifications = Notification.objects.bulk_create(
+        [Notification(recipient_id=provider, kind=kind, order_id=order) for provider, order in pairs]
+    )
+    immediate = set(NotificationPreference.objects.filter(
+        user__in={provider for provider, _ in pairs}, delivery=DeliveryChoices.IMMEDIATE
+    ).values_list('user_id', flat=True))
+    schedule_delivery([notification.id for notification in notifications if notification.recipient_id in immediate])
+
+
+def load_pending(queryset):
+    """ Загрузка пачки неотправленных уведомлений из выборки (до NOTIFICATION_BATCH_SIZE) вместе со всеми данными
+    писем: уведомления с получателями, заказами и покупателями - одним запросом, позиции заказов с товарами и
+    поставщиками - ещё тремя на всю пачку.
+
+    Пачка забирается на отправку в короткой транзакции: строки выбираются с SKIP LOCKED и отмечаются claimed_at, после
+    чего блокировки снимаются. Одновременно работающие задачи пропускают взятые уведомления и не отправят их дважды, а
+    уведомления упавшей задачи снова отправляются через NOTIFICATION_CLAIM_TIMEOUT секунд """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        notifications = list(queryset.filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale), sent_at__isnull=True)
+                             .select_related('recipient', 'order__user')
+                             .select_for_update(skip_locked=True, of=('self',))
+                             .order_by('id')[:settings.NOTIFICATION_BATCH_SIZE])
+        Notification.objects.filter(id__in=[notification.id for notification in notifications]).update(claimed_at=now)
+    prefetch_related_objects([notification.order for notification in notifications
+                              if notification.kind not in DIGEST_KINDS and notification.order is not None],
+                             'position__product', 'position__provider')
+    return notifications
+
+
+def render_pending(notifications):
+    """ Отрисовка писем пачки, загруженной load_pending, без запросов к базе. События заказов для поставщика и
+    подтверждения заказов покупателю объединяются в одно письмо на получателя, остальные письма - по одному на
+    уведомление. Возвращает письма, группы
+    уведомлений каждого письма и уведомления получателей без адреса, которые нужно только отметить отправленными """
+    by_recipient = defaultdict(list)
+    for notification in notifications:
+        by_recipient[notification.recipient].append(notification)
+    messages = []
+    groups = []
+    skipped = []
+    for recipient, items in by_recipient.items():
+        if not recipient.email:
+            skipped.extend(items)
+            continue
+        digest = [notification for notification in items if notification.kind in DIGEST_KINDS]
+        if digest:
+            messages.append(provider_digest(recipient, digest))
+            groups.append(digest)
+        for kind, build in GROUPED_MESSAGES.items():
+            group = [notification for notification in items if notification.kind == kind]
+            if group:
+                messages.append(build(recipient, group))
+                groups.append(group)
+        for notification in items:
+            if notification.kind in MESSAGES:
+                messages.append(MESSAGES[notification.kind](notification))
+                groups.append([notification])
+    return messages, groups, skipped
+
+
+def send_pending(queryset):
+    """ Отправка неотправленных уведомлений из выборки пачкой до NOTIFICATION_BATCH_SIZE уведомлений: загрузка,
+    отрисовка и отправка через пул соединений. Письма отправляются вне транзакции и без блокировок строк, затем во
+    второй короткой транзакции отправленные уведомления отмечаются sent_at, а с неотправленных снимается отметка
+    claimed_at, чтобы их отправила следующая задача. Возвращает id последнего уведомления пачки, если выборка могла
+    остаться непрочитанной """
+    notifications = load_pending(queryset)
+    messages, groups, done = render_pending(notifications)
+    for group, ok in zip(groups, deliver(messages)):
+        if ok:
+            done.extend(group)
+    sent = {notification.id for notification in done}
+    with transaction.atomic():
+        Notification.objects.filter(id__in=sent).update(sent_at=timezone.now())
+        Notification.objects.filter(id__in=[notification.id for notification in notifications
+                                            if notification.id not in sent]).update(claimed_at=None)
+    if len(notifications) == settings.NOTIFICATION_BATCH_SIZE:
+        return notifications[-1].id
+    return None
+
+
+@celery_app.task
+def send_notifications(notification_ids):
+    """ Отправка уведомлений, записанных зафиксированными транзакциями """
+    send_pending(Notification.objects.filter(id__in=notification_ids))
+
+
+@celery_app.task
+def send_notification_digests():
+    """ Периодическая отправка сводок: все накопившиеся уведомления получателя за окно NOTIFICATION_DIGEST_WINDOW
+    уходят одним письмом. Заодно отправляются письма, которые не удалось отправить раньше """
+    last_id = 0
+    while last_id is not None:
+        last_id = send_pending(Notification.objects.filter(id__gt=last_id))
@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """ Курсорная пагинация каталога по id: глубокие страницы стоят столько же, сколько первая """
+
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class OrderCursorPagination(CursorPagination):
+    """ Курсорная пагинация заказов, новые первыми """
+
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,59 @@
+import yaml
+
+from rest_framework.exceptions import ValidationError
+
+
+class PriceListReader:
+    """ Потоковое чтение прайс-листа в формате yaml.
+
+    Разделы shop и categories читаются целиком, товары из раздела goods собираются из событий парсера по одному,
+    поэтому память не зависит от размера файла, а импорт начинается до окончания чтения. """
+
+    def __init__(self, stream):
+        self.loader = yaml.SafeLoader(stream)
+        self.shop = None
+        self.categories = []
+        self._in_goods = False
+
+    def read_header(self):
+        """ Чтение разделов прайс-листа, идущих до goods """
+        for event in (yaml.StreamStartEvent, yaml.DocumentStartEvent, yaml.MappingStartEvent):
+            self._expect(event)
+        self._read_sections()
+        if self.shop is None:
+            raise ValidationError({"file": "В прайсе до раздела goods должно быть указано имя поставщика (shop)"})
+        return self
+
+    def goods(self):
+        """ Генератор товаров прайс-листа """
+        while self._in_goods and not self.loader.check_event(yaml.SequenceEndEvent):
+            yield self._construct(self.loader.compose_node(None, None))
+        if self._in_goods:
+            self._expect(yaml.SequenceEndEvent)
+            self._in_goods = False
+            self._read_sections()
+
+    def _read_sections(self):
+        """ Чтение разделов верхнего уровня до начала goods или до конца документа """
+        while not self.loader.check_event(yaml.MappingEndEvent):
+            key = self._construct(self.loader.compose_node(None, None))
+            if key == 'goods' and self.loader.check_event(yaml.SequenceStartEvent):
+                self.loader.get_event()
+                self._in_goods = True
+                return
+            value = self._construct(self.loader.compose_node(None, None))
+            if key == 'shop':
+                self.shop = value
+            elif key == 'categories':
+                self.categories = value or []
+
+    def _construct(self, node):
+        data = self.loader.construct_object(node, deep=True)
+        self.loader.constructed_objects = {}
+        self.loader.recursive_objects = {}
+        return data
+
+    def _expect(self, event):
+        if not self.loader.check_event(event):
+            raise ValidationError({"file": "Неверный формат прайс-листа"})
+        self.loader.get_event()
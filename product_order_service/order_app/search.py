@@ -0,0 +1,106 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery
+from django.utils.functional import cached_property
+
+from order_app.models import Price, Product
+
+SEARCH_CONFIG = 'russian'
+
+
+def product_search_vector():
+    """ Выражение поискового вектора товара: название важнее описания """
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='B', config=SEARCH_CONFIG))
+
+
+def update_search_vectors(product_ids):
+    """ Пересчёт поисковых векторов указанных товаров одним запросом """
+    if product_ids:
+        Product.objects.filter(id__in=product_ids).update(search_vector=product_search_vector())
+
+
+@lru_cache(maxsize=None)
+def trigram_available():
+    """ Установлено ли в базе расширение pg_trgm """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        return cursor.fetchone()[0]
+
+
+class ProductSearch:
+    """ Полнотекстовый поиск товаров с фасетами по категориям и диапазонам цен.
+
+    Поиск идёт по индексированному полю search_vector, если по запросу ничего не найдено - по триграммному сходству
+    названия (или по вхождению подстроки, если pg_trgm не установлен). Цена товара - минимальная цена у активных
+    поставщиков. """
+
+    def __init__(self, queryset, params):
+        self.queryset = queryset
+        self.text = params.get('q', '').strip()
+        self.categories = [int(value) for value in params.get('category', '').split(',') if value.strip().isdigit()]
+        self.price_min = self._number(params.get('price_min'))
+        self.price_max = self._number(params.get('price_max'))
+
+    @staticmethod
+    def _number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    @cached_property
+    def matched(self):
+        """ Товары, подходящие под текст запроса, упорядоченные по релевантности """
+        min_price = Price.objects.filter(product=OuterRef('pk'), provider__is_active=True).values('product')
+        queryset = self.queryset.annotate(min_price=Subquery(min_price.annotate(value=Min('price')).values('value')))
+        if not self.text:
+            return queryset.order_by('id')
+        query = SearchQuery(self.text, config=SEARCH_CONFIG, search_type='websearch')
+        found = queryset.filter(search_vector=query)
+        if found.exists():
+            return found.annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', 'id')
+        if trigram_available():
+            return queryset.annotate(similarity=TrigramSimilarity('name', self.text)).filter(
+                similarity__gte=settings.PRODUCT_SEARCH_TRIGRAM_THRESHOLD
+            ).order_by('-similarity', 'id')
+        return queryset.filter(name__icontains=self.text).order_by('id')
+
+    def filter_categories(self, queryset):
+        if self.categories:
+            queryset = queryset.filter(category_id__in=self.categories)
+        return queryset
+
+    def filter_price(self, queryset):
+        if self.price_min is not None:
+            queryset = queryset.filter(min_price__gte=self.price_min)
+        if self.price_max is not None:
+            queryset = queryset.filter(min_price__lte=self.price_max)
+        return queryset
+
+    def results(self):
+        """ Товары с учётом всех фильтров """
+        return self.filter_price(self.filter_categories(self.matched))
+
+    def category_facets(self):
+        """ Число товаров по категориям без учёта фильтра по категории """
+        rows = self.filter_price(self.matched).order_by().values('category_id', 'category__name').annotate(
+            count=Count('id')
+        ).order_by('-count', 'category_id')
+        return [{'id': row['category_id'], 'name': row['category__name'], 'count': row['count']} for row in rows]
+
+    def price_facets(self):
+        """ Число товаров по диапазонам цен без учёта фильтра по цене """
+        ranges = settings.PRODUCT_SEARCH_PRICE_RANGES
+        aggregates = {}
+        for number, (low, high) in enumerate(ranges):
+            condition = Q(min_price__gte=low)
+            if high is not None:
+                condition &= Q(min_price__lt=high)
+            aggregates[f'range_{number}'] = Count('id', filter=condition)
+        counts = self.filter_categories(self.matched).order_by().aggregate(**aggregates)
+        return [{'min': low, 'max': high, 'count': counts[f'range_{number}']}
+                for number, (low, high) in enumerate(ranges)]
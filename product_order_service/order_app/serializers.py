@@ -1,10 +1,19 @@
-from order_app.email_sender import order_confirm, message_to_provider, send_message_reg_confirm
+from decimal import Decimal
 
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from order_app.models import Price, Position, Category, Product, Order
+from order_app.analytics import record_sales
+from order_app.cache import bump_catalogue_version
+from order_app.events import publish_status_change
+from order_app.models import Price, Position, Category, Product, Order, ImportJob, OrderStatusChoices, \
+    NotificationKindChoices, NotificationPreference
+from order_app.notifications import notify, notify_providers
+from order_app.search import update_search_vectors
+from order_app.stock import stock_demand, reserve_stock, release_stock
 
 
 class AppUserSerializer(serializers.ModelSerializer):
@@ -25,6 +34,7 @@ class RegistrationSerializer(serializers.ModelSerializer):
             'password': {'write_only': True}
         }
 
+    @transaction.atomic
     def create(self, validated_data):
         """ Метод регистрирующий пользователя и отправляющий сообщение о регистрации """
         username = validated_data['username']
@@ -36,9 +46,9 @@ class RegistrationSerializer(serializers.ModelSerializer):
             raise ValidationError({"email": "Введите адрес электронной почты!"})
         elif password is None:
             raise ValidationError({"password": "Введите пароль!"})
-        emails = (username, email)
-        send_message_reg_confirm.delay(emails)
-        return User.objects.create_user(**validated_data)
+        user = User.objects.create_user(**validated_data)
+        notify(user, NotificationKindChoices.REGISTERED)
+        return user
 
 
 class PriceSerializer(serializers.ModelSerializer):
@@ -52,7 +62,11 @@ class PriceSerializer(serializers.ModelSerializer):
 
 
 class PositionSerializer(serializers.ModelSerializer):
-    """ Сериализатор списка позиций """
+    """ Сериализатор списка позиций. Товар и поставщик принимаются как id без отдельного запроса на каждую позицию,
+    их наличие проверяется вместе с ценами в order_prices """
+
+    product = serializers.IntegerField(source='product_id')
+    provider = serializers.IntegerField(source='provider_id')
 
     class Meta:
         model = Position
@@ -60,6 +74,77 @@ class PositionSerializer(serializers.ModelSerializer):
         read_only_fields = ('order',)
 
 
+def order_prices(items):
+    """ Цены позиций заказа вместе с поставщиками одним запросом с проверкой, что товар продаётся у поставщика и
+    поставщик принимает заказы """
+    prices = load_prices(items)
+    check_prices(items, prices)
+    return prices
+
+
+def load_prices(items):
+    """ Цены с поставщиками для позиций одного или нескольких заказов одним запросом """
+    products = {item['product_id'] for item in items}
+    providers = {item['provider_id'] for item in items}
+    return {(price.product_id, price.provider_id): price for price in
+            Price.objects.filter(product__in=products, provider__in=providers).select_related('provider')}
+
+
+def check_prices(items, prices):
+    """ Проверка по загруженным ценам, что товары позиций продаются у поставщиков и поставщики принимают заказы """
+    for item in items:
+        price = prices.get((item['product_id'], item['provider_id']))
+        if price is None:
+            raise ValidationError({"Price": f"Товар {item['product_id']} не продаётся у поставщика "
+                                            f"{item['provider_id']}."})
+        if not price.provider.is_active:
+            raise ValidationError({"Provider": f"Поставщик {str(price.provider).capitalize()} не принимает заказы."})
+
+
+def order_positions(order, items, prices):
+    """ Позиции заказа, количество товаров и сумма заказа по загруженным ценам. Цена и сумма позиции фиксируются в
+    момент заказа, сумма заказа складывается в Decimal без ошибок округления """
+    positions = []
+    count = 0
+    total = Decimal(0)
+    for item in items:
+        price = prices[(item['product_id'], item['provider_id'])].price
+        line_total = price * item['quantity']
+        count += item['quantity']
+        total += line_total
+        positions.append(Position(order=order, product_id=item['product_id'], provider_id=item['provider_id'],
+                                  quantity=item['quantity'], price=price, total=line_total))
+    return positions, count, total
+
+
+def change_order_status(order, status):
+    """ Смена статуса заказа с возвратом товаров на склад при отмене и повторным резервированием при выходе из отмены.
+    Отменённые заказы не входят в сводки продаж, об отмене уведомляются поставщики заказа.
+
+    Статус меняется условным UPDATE, поэтому при одновременных запросах остатки возвращаются или резервируются
+    только один раз. О смене статуса покупатель и поставщики получают событие в потоке /api/v1/orders/events/ """
+    cancelled = OrderStatusChoices.CANCELLED
+    if status == order.status:
+        return
+    if cancelled not in (status, order.status):
+        publish_status_change(order, status)
+        order.status = status
+        return
+    orders = Order.objects.filter(id=order.id)
+    if status == cancelled:
+        if orders.exclude(status=cancelled).update(status=status):
+            release_stock(order)
+            record_sales([order], -1)
+            notify_providers([order], NotificationKindChoices.ORDER_CANCELLED)
+            publish_status_change(order, status)
+    elif orders.filter(status=cancelled).update(status=status):
+        items = list(order.position.values('product_id', 'provider_id', 'quantity'))
+        reserve_stock(stock_demand(items, order_prices(items)))
+        record_sales([order])
+        publish_status_change(order, status)
+    order.status = status
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -67,7 +152,26 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """ Множество полей из параметра запроса fields или None, если параметр не передан """
+    fields = getattr(request, 'query_params', {}).get('fields')
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(',')}
+
+
+class DynamicFieldsMixin:
+    """ Оставляет в ответе только поля, перечисленные в параметре запроса fields, например ?fields=id,name """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer для списка продуктов."""
 
     providers_info = PriceSerializer(many=True, source='price.all')
@@ -75,17 +179,17 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('search_vector',)
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer для каждого продукта"""
 
     providers_info = PriceSerializer(many=True, source='price.all')
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('search_vector',)
 
     def update(self, instance, validated_data):
         if self.context['request'].user.is_staff or self.context['request'].user.is_superuser:
@@ -98,7 +202,10 @@ class ProductDetailSerializer(serializers.ModelSerializer):
                     product_info.price = price['price']
                     product_info.save()
             instance.description = validated_data.get('description', instance.description)
+            instance.parameters = validated_data.get('parameters', instance.parameters)
             instance.save()
+            update_search_vectors([instance.id])
+            bump_catalogue_version()
             return instance
         else:
             raise ValidationError({"Products": "Поставщик может менять информацию только о своих товарах"})
@@ -118,31 +225,29 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = '__all__'
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """ Изменение заказа со сменой статуса через change_order_status """
+        change_order_status(instance, validated_data.pop('status', instance.status))
+        return super().update(instance, validated_data)
+
+    @transaction.atomic
     def create(self, validated_data):
-        """ Метод создания заказов с отправкой сообщения покупателю с подтверждением и поставщикам о новом заказе """
+        """ Метод создания заказов с отправкой сообщения покупателю с подтверждением и поставщикам о новом заказе.
+        Цены и поставщики всех позиций проверяются одним запросом до записи, заказ записывается одним INSERT с
+        итоговыми количеством и суммой, позиции - одним bulk_create. Остатки резервируются и сводки продаж
+        пополняются последними запросами транзакции, чтобы их строки были заблокированы как можно меньше """
         validated_data['user'] = self.context["request"].user
-        positions = validated_data.pop(
-            'position')
-        positions_objs = []
-        validated_data['count'] = 0
-        validated_data['total'] = 0
-        order = super().create(validated_data)
-        for position in positions.values():
-            for item in position:
-                provider = User.objects.get(username=item['provider'])
-                if not provider.is_active:
-                    raise ValidationError({"Provider": f"Поставщик {str(provider).capitalize()} не принимает заказы."})
-                price = Price.objects.get(product=item['product'].id, provider=item['provider']).price
-                validated_data['total'] += price * item['quantity']
-                validated_data['count'] += item['quantity']
-                positions_objs.append(Position(quantity=item['quantity'],
-                                               product=item['product'], order=order, provider=item['provider']))
-        order.count = validated_data['count']
-        order.total = validated_data['total']
+        items = [item for position in validated_data.pop('position').values() for item in position]
+        prices = order_prices(items)
+        order = Order(**validated_data)
+        positions, order.count, order.total = order_positions(order, items, prices)
         order.save()
-        Position.objects.bulk_create(positions_objs)
-        order_confirm.delay(int(order.id))
-        message_to_provider.delay(int(order.id))
+        Position.objects.bulk_create(positions)
+        reserve_stock(stock_demand(items, prices))
+        record_sales([order])
+        notify(order.user, NotificationKindChoices.ORDER_CONFIRMED, order)
+        notify_providers([order], NotificationKindChoices.NEW_ORDER)
         return order
 
 
@@ -164,30 +269,55 @@ class OrderDetailSerializer(serializers.ModelSerializer):
         """ Метод позволяющий внести изменения в заказ """
         user = self.context['request'].user
         if not user.is_staff and user.is_authenticated:
-            my_view = self.context['view']
-            order_id = my_view.kwargs.get('pk')
-            positions = validated_data.pop(
-                'position')
-            positions_objs = []
-            for position in positions.values():
-                for item in position:
-                    price = Price.objects.get(product=item['product'].id, provider=item['provider']).price
-                    validated_data['total'] += price * item['quantity']
-                    validated_data['count'] += item['quantity']
-                    positions_objs.append(Position(quantity=item['quantity'],
-                                                   product=item['product'], order=order_id, provider=item['provider']))
-            if validated_data['status'] == 'CANCELLED':
-                instance.status = validated_data.get('status', instance.status)
-                instance.count = validated_data.get('count', instance.count)
-                instance.total = validated_data.get('total', instance.total)
-                instance.save()
-                Position.objects.bulk_update(positions_objs)
-                return instance
-            else:
+            if validated_data.get('status') != 'CANCELLED':
                 raise ValidationError({"Order": "Авторизованный пользователь может менять статус только на 'Отменён'"})
+            items = [item for position in validated_data.pop('position', {}).values() for item in position]
+            with transaction.atomic():
+                change_order_status(instance, validated_data['status'])
+                if items:
+                    positions, instance.count, instance.total = order_positions(instance, items, order_prices(items))
+                    instance.position.all().delete()
+                    Position.objects.bulk_create(positions)
+                instance.save()
+            return instance
         elif user.is_staff:
-            instance.status = validated_data.get('status', instance.status)
-            instance.save()
+            with transaction.atomic():
+                change_order_status(instance, validated_data.get('status', instance.status))
+                instance.save()
             return instance
         else:
             raise ValidationError({"Order": "Менять статус заказа может только админ"})
+
+
+class NotificationPreferenceSerializer(serializers.ModelSerializer):
+    """ Сериализатор настройки доставки уведомлений """
+
+    class Meta:
+        model = NotificationPreference
+        fields = ('delivery',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """ Сериализатор задания импорта прайс-листа """
+
+    elapsed = serializers.SerializerMethodField()
+    throughput = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'status', 'file', 'processed', 'inserted', 'updated', 'unchanged', 'removed', 'failed', 'error',
+                  'report', 'created_at', 'started_at', 'finished_at', 'elapsed', 'throughput')
+        read_only_fields = fields
+
+    def get_elapsed(self, obj):
+        """ Длительность импорта в секундах """
+        if obj.started_at is None:
+            return None
+        return ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+
+    def get_throughput(self, obj):
+        """ Скорость импорта в товарах в секунду """
+        elapsed = self.get_elapsed(obj)
+        if not elapsed:
+            return None
+        return round(obj.processed / elapsed, 1)
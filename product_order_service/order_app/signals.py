@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from order_app.authentication import SNAPSHOT_FIELDS, invalidate_tokens
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """ Выход пользователя и удаление токена """
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """ Изменение полей пользователя, которые хранятся в кэше авторизации, например, блокировка (is_active) """
+    if created or (update_fields is not None and not set(update_fields) & set(SNAPSHOT_FIELDS)):
+        return
+    invalidate_tokens(Token.objects.filter(user=instance.id).values_list('key', flat=True))
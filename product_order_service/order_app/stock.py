@@ -0,0 +1,74 @@
+from collections import Counter
+
+from django.db import connection
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from rest_framework.exceptions import ValidationError
+
+from order_app.models import OrderStatusChoices, Price, Position
+
+# заказы, товары которых ещё на складе поставщика и зарезервированы
+RESERVING_STATUSES = (OrderStatusChoices.NEW, OrderStatusChoices.IN_PROGRESS)
+
+
+def stock_demand(items, prices):
+    """ Количество товара, которое нужно зарезервировать по каждой цене, для позиций заказа """
+    demand = Counter()
+    for item in items:
+        demand[prices[(item['product_id'], item['provider_id'])].id] += item['quantity']
+    return demand
+
+
+def reserved_stock():
+    """ Выражение для цены: сколько её товара зарезервировано незавершёнными заказами """
+    positions = Position.objects.filter(product=OuterRef('product'), provider=OuterRef('provider'),
+                                        order__status__in=RESERVING_STATUSES)
+    return Coalesce(Subquery(positions.values('product').annotate(total=Sum('quantity')).values('total')), 0)
+
+
+def available_stock(quantity, reserved):
+    """ Доступный остаток из остатка поставщика в прайс-листе и резерва незавершённых заказов """
+    return max(quantity - reserved, 0)
+
+
+def reserve_stock(demand):
+    """ Резервирование остатков одним условным UPDATE ... WHERE quantity >= количества заказа.
+
+    Остаток уменьшается в базе без предварительного чтения, строка блокируется только на время оставшейся части
+    транзакции. Если остатка хватает не по всем ценам, выбрасывается ValidationError и транзакция заказа
+    откатывается вместе с уже уменьшенными остатками, поэтому вызывать нужно внутри transaction.atomic. Цены без
+    учёта остатка (quantity IS NULL) не ограничивают заказ и остаются без учёта. """
+    if not demand:
+        return
+    ids = sorted(demand)
+    table = connection.ops.quote_name(Price._meta.db_table)
+    values = ', '.join(['(%s, %s)'] * len(ids))
+    params = [value for price_id in ids for value in (price_id, demand[price_id])]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET quantity = {table}.quantity - v.quantity '
+            f'FROM (VALUES {values}) AS v(id, quantity) '
+            f'WHERE {table}.id = v.id AND ({table}.quantity IS NULL OR {table}.quantity >= v.quantity) '
+            f'RETURNING {table}.id',
+            params
+        )
+        reserved = {row[0] for row in cursor.fetchall()}
+    missing = [price_id for price_id in ids if price_id not in reserved]
+    if missing:
+        names = Price.objects.filter(id__in=missing).values_list('product__name', flat=True)
+        raise ValidationError({"Stock": f"Недостаточно товара на складе: {', '.join(names)}."})
+
+
+def release_stock(order):
+    """ Возврат на склад товаров всех позиций заказа одним UPDATE """
+    table = connection.ops.quote_name(Price._meta.db_table)
+    positions = connection.ops.quote_name(Position._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET quantity = {table}.quantity + p.quantity '
+            f'FROM (SELECT product_id, provider_id, SUM(quantity) AS quantity FROM {positions} '
+            f'WHERE order_id = %s GROUP BY product_id, provider_id) AS p '
+            f'WHERE {table}.product_id = p.product_id AND {table}.provider_id = p.provider_id',
+            [order.id]
+        )
@@ -0,0 +1,40 @@
+from django.utils import timezone
+
+from order_app.idempotency import delete_expired_idempotency_keys
+from order_app.importer import PriceListImporter
+from order_app.models import ImportJob, ImportStatusChoices
+from order_app.notifications import send_notifications, send_notification_digests
+from order_app.price_list import PriceListReader
+from product_order_service import celery_app
+
+__all__ = ('import_price_list', 'send_notifications', 'send_notification_digests', 'delete_expired_idempotency_keys')
+
+
+@celery_app.task
+def import_price_list(job_id):
+    """ Фоновый импорт загруженного прайс-листа """
+    job = ImportJob.objects.select_related('provider').get(id=job_id)
+    job.status = ImportStatusChoices.RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+    importer = PriceListImporter(job.provider, job=job)
+    try:
+        with job.file.open('rb') as stream:
+            price_list = PriceListReader(stream).read_header()
+            importer.import_categories(price_list.categories)
+            importer.import_goods(price_list.goods())
+        importer.finish()
+    except Exception as error:
+        job.status = ImportStatusChoices.FAILED
+        job.error = str(error)
+    else:
+        job.status = ImportStatusChoices.DONE
+    job.processed = importer.processed
+    job.inserted = importer.inserted
+    job.updated = importer.updated
+    job.failed = importer.failed
+    job.unchanged = len(importer.unchanged)
+    job.removed = len(importer.removed)
+    job.report = importer.report
+    job.finished_at = timezone.now()
+    job.save()
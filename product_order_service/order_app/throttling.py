@@ -0,0 +1,71 @@
+import logging
+import secrets
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+# Скользящее окно: в отсортированном множестве ключа хранятся времена разрешённых запросов за последние duration
+# секунд. Проверка и запись выполняются атомарно одним вызовом скрипта, поэтому лимит соблюдается всеми процессами и
+# серверами. Возвращает {1, 0}, если запрос разрешён, иначе {0, "секунд до освобождения места в окне"}
+SLIDING_WINDOW = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local duration = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - duration)
+if redis.call('ZCARD', key) < limit then
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('PEXPIRE', key, math.ceil(duration * 1000))
+    return {1, 0}
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+return {0, tostring(tonumber(oldest[2]) + duration - now)}
+"""
+
+_redis = None
+_script = None
+
+
+def get_redis():
+    """ Соединение процесса с Redis для счётчиков. Скрипт выполняется по sha (EVALSHA) и загружается на сервер только
+    при первом вызове, поэтому проверка запроса - один обмен с Redis """
+    global _redis, _script
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.THROTTLE_REDIS_URL, socket_timeout=settings.THROTTLE_REDIS_TIMEOUT,
+                                      socket_connect_timeout=settings.THROTTLE_REDIS_TIMEOUT)
+        _script = _redis.register_script(SLIDING_WINDOW)
+    return _script
+
+
+class RedisRateThrottle(SimpleRateThrottle):
+    """ Ограничение частоты запросов скользящим окном в Redis вместо кэша процесса. Частоты задаются как обычно, в
+    DEFAULT_THROTTLE_RATES. Если Redis недоступен, запрос пропускается: ограничение не должно останавливать сервис """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        try:
+            allowed, wait = get_redis()(keys=[self.key],
+                                        args=[self.timer(), self.duration, self.num_requests, secrets.token_hex(8)])
+        except redis.RedisError as error:
+            logger.warning("Ограничение частоты %s не проверено: %s", self.key, error)
+            return True
+        self.wait_seconds = float(wait)
+        return bool(allowed)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class RedisAnonRateThrottle(AnonRateThrottle, RedisRateThrottle):
+    """ Ограничение частоты запросов анонимных пользователей """
+
+
+class RedisScopedRateThrottle(ScopedRateThrottle, RedisRateThrottle):
+    """ Ограничение частоты запросов по throttle_scope представления """
@@ -2,10 +2,13 @@ from django.urls import path
 
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from order_app.views import ProductViewSet, UserViewSet, OrderViewSet, RegistrationViewSet, CategoryView
+from order_app import async_views
+from order_app.views import ProductViewSet, UserViewSet, OrderViewSet, RegistrationViewSet, CategoryView, \
+    ImportJobViewSet, AnalyticsViewSet, NotificationPreferenceViewSet
 
 urlpatterns = format_suffix_patterns([
     path('products/', ProductViewSet.as_view({'get': 'list', 'post': 'create'})),
+    path('products/search/', ProductViewSet.as_view({'get': 'search'})),
     path('products/<int:pk>/', ProductViewSet.as_view({'get': 'retrieve', 'put': 'update'})),
     path('providers/', UserViewSet.as_view({'get': 'list', 'post': 'create'})),
     path('orders/', OrderViewSet.as_view({'get': 'list', 'post': 'create'})),
@@ -13,6 +16,17 @@ urlpatterns = format_suffix_patterns([
                                                    'delete': 'destroy'})),
     path('user-info/', UserViewSet.as_view({'get': 'list', 'post': 'create'})),
     path('user-info/<int:pk>/', UserViewSet.as_view({'get': 'retrieve', 'delete': 'destroy', 'patch': 'partial_update'})),
+    path('imports/<int:pk>/', ImportJobViewSet.as_view({'get': 'retrieve'})),
+    path('analytics/', AnalyticsViewSet.as_view({'get': 'list'})),
+    path('notification-settings/', NotificationPreferenceViewSet.as_view({'get': 'retrieve', 'patch': 'partial_update'})),
     path('categories/', CategoryView.as_view({'get': 'list'})),
     path('registration/', RegistrationViewSet.as_view({'post': 'create'})),
 ])
+
+# асинхронные представления для чтения под ASGI-сервером
+urlpatterns += [
+    path('async/products/', async_views.product_list),
+    path('async/products/<int:pk>/', async_views.product_detail),
+    path('async/categories/', async_views.category_list),
+    path('async/orders/<int:pk>/', async_views.order_detail),
+]
@@ -1,33 +1,73 @@
-import bios
-
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import transaction, IntegrityError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
 from django.http import JsonResponse
 
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
-
-from order_app.email_sender import changed_status_message, cancelled_status_message
-from order_app.models import Product, Price, Category, Order
+from rest_framework.status import HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST, \
+    HTTP_429_TOO_MANY_REQUESTS
+from rest_framework.viewsets import ModelViewSet, ViewSet
+
+from order_app.analytics import SalesReport
+from order_app.bulk_orders import BulkOrderCreator
+from order_app.cache import cached_catalogue, bump_catalogue_version
+from order_app.filters import filter_parameters
+from order_app.idempotency import IdempotentThrottleMixin, idempotent
+from order_app.models import Product, Price, Category, Order, ImportJob, ImportStatusChoices, Position, \
+    OrderStatusChoices, NotificationPreference, NotificationKindChoices
+from order_app.notifications import notify
+from order_app.pagination import ProductCursorPagination, OrderCursorPagination
+from order_app.price_list import PriceListReader
+from order_app.search import ProductSearch
 from order_app.serializers import ProductSerializer, ProductDetailSerializer, AppUserSerializer, RegistrationSerializer, \
-    OrderSerializer, OrderDetailSerializer, CategorySerializer
+    OrderSerializer, OrderDetailSerializer, CategorySerializer, ImportJobSerializer, requested_fields, \
+    NotificationPreferenceSerializer
+from order_app.tasks import import_price_list
+
 
+def query_param_int(request, name, default):
+    """ Неотрицательное целое из параметров запроса """
+    try:
+        return max(int(request.query_params.get(name, default)), 0)
+    except ValueError:
+        return default
 
-class ProductViewSet(ModelViewSet):
+
+class ProductViewSet(IdempotentThrottleMixin, ModelViewSet):
     """ViewSet для продуктов """
 
-    queryset = Product.objects.filter(providers_info__is_active=True)
+    pagination_class = ProductCursorPagination
+
+    def get_queryset(self):
+        """ Товары активных поставщиков. Фильтр через EXISTS не размножает строки товаров, а цены, поставщики и
+        категории подгружаются заранее, поэтому число запросов не зависит от количества товаров. Поля, не
+        запрошенные в параметре fields, не загружаются. Поддерживаются фильтры по параметрам товара ?param[...] """
+        fields = requested_fields(self.request)
+        active_prices = Price.objects.filter(product=OuterRef('pk'), provider__is_active=True)
+        queryset = Product.objects.filter(Exists(active_prices)).defer('search_vector').order_by('id')
+        if fields is None or 'category' in fields:
+            queryset = queryset.select_related('category')
+        if fields is None or 'providers_info' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('price', queryset=Price.objects.select_related('provider').order_by('id'))
+            )
+        if fields is not None:
+            queryset = queryset.defer(*[name for name in ('description', 'parameters') if name not in fields])
+        return filter_parameters(queryset, self.request.query_params)
 
     def get_throttles(self):
-        if self.action == 'list':
+        if self.action in ['list', 'search']:
             self.throttle_scope = 'anon'
         elif self.action == 'create':
             self.throttle_scope = 'uploads'
         return super().get_throttles()
 
     def get_serializer_class(self):
-        if self.action in ["list", "create"]:
+        if self.action in ["list", "create", "search"]:
             return ProductSerializer
         elif self.action in ["retrieve", "update"]:
             return ProductDetailSerializer
@@ -38,55 +78,67 @@ class ProductViewSet(ModelViewSet):
             return [IsAdminUser()]
         return []
 
+    @cached_catalogue
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_catalogue
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False)
+    @cached_catalogue
+    def search(self, request):
+        """ Полнотекстовый поиск товаров (q) с фильтрами по категориям (category=1,2) и цене (price_min, price_max)
+        и фасетами: числом найденных товаров по категориям и диапазонам цен """
+        search = ProductSearch(self.get_queryset(), request.query_params)
+        results = search.results()
+        limit = min(query_param_int(request, 'limit', settings.PRODUCT_SEARCH_PAGE_SIZE), 100)
+        offset = query_param_int(request, 'offset', 0)
+        serializer = self.get_serializer(results[offset:offset + limit], many=True)
+        return Response(data={
+            "count": results.count(),
+            "results": serializer.data,
+            "facets": {"categories": search.category_facets(), "price_ranges": search.price_facets()},
+        })
+
+    @idempotent('uploads')
     @transaction.atomic
     def create(self, request, *args, **kwargs):
-        """ Метод импорта файла yaml """
+        """ Метод загрузки файла yaml, импорт выполняется в фоне задачей celery """
 
         up_file = request.FILES['file']
-        my_dict = bios.read(up_file.name, file_type='yaml')
-        provider = my_dict['shop']
-        provider = User.objects.get(username=provider)
+        price_list = PriceListReader(up_file).read_header()
+        provider = User.objects.get(username=price_list.shop)
 
         if request.user.is_staff and str(request.user) == provider.username:
-
-            for item in my_dict['goods']:
-                description_list = []
-                product = item['name']
-                category = item['category']
-                price = item['price']
-                description = item['parameters']
-
-                for key, value in description.items():
-                    description_dict = {key: value}
-                    description_list.append(description_dict)
-
-                for data in my_dict['categories']:
-                    if data['id'] not in Category.objects.values_list('id', flat=True):
-                        Category.objects.create(id=data['id'], name=data['name'])
-
-                try:
-                    product_existence = Product.objects.get(name=product)
-
-                    price_info = Price.objects.get(product_id=product_existence.id, provider_id=provider.id)
-                    product_existence.name = product
-                    product_existence.description = description_list
-                    product_existence.category.id = category
-                    product_existence.save()
-                    price_info.product_id = product_existence.id
-                    price_info.provider_id = request.user.id
-                    price_info.price = price
-                    price_info.save()
-
-                except (Product.DoesNotExist, IntegrityError):
-                    product = Product.objects.create(name=product, category_id=category, description=description_list)
-                    Price.objects.create(product_id=product.id, provider_id=provider.id, price=price)
-            return Response(data={"file": f"{up_file.name} uploaded"})
+            User.objects.select_for_update().get(id=provider.id)
+            active_jobs = ImportJob.objects.filter(
+                provider=provider, status__in=[ImportStatusChoices.PENDING, ImportStatusChoices.RUNNING]
+            ).count()
+            if active_jobs >= settings.PRICE_LIST_IMPORT_MAX_ACTIVE_JOBS:
+                return Response(data={"file": "Дождитесь окончания предыдущего импорта"},
+                                status=HTTP_429_TOO_MANY_REQUESTS)
+            job = ImportJob.objects.create(provider=provider, file=up_file)
+            transaction.on_commit(lambda: import_price_list.delay(job.id))
+            return Response(data=ImportJobSerializer(job).data, status=HTTP_202_ACCEPTED)
 
         else:
             return Response(data={"User": f"Пользователь {request.user} не является поставщиком, либо неправильно "
                                           "указано имя поставщика в прайсе"})
 
 
+class ImportJobViewSet(ModelViewSet):
+    """ ViewSet для просмотра хода импорта прайс-листа """
+
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """ Поставщик видит только свои задания импорта """
+        return ImportJob.objects.filter(provider=self.request.user.id)
+
+
 class UserViewSet(ModelViewSet):
     """ ViewSet для данных пользователя """
 
@@ -124,11 +176,33 @@ class UserViewSet(ModelViewSet):
         if user.is_staff:
             if serializer.is_valid():
                 serializer.save()
+                bump_catalogue_version()
             return JsonResponse(data=serializer.data)
         else:
             return Response(data={"User": "Менять статус могут только поставщики!"})
 
 
+class AnalyticsViewSet(ViewSet):
+    """ Отчёты о продажах поставщика из сводок продаж. Администратор видит продажи всех поставщиков """
+
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        provider = None if request.user.is_superuser else request.user
+        return Response(data=SalesReport(request.query_params, provider=provider).rows())
+
+
+class NotificationPreferenceViewSet(ModelViewSet):
+    """ Настройка доставки уведомлений текущего пользователя: сразу (IMMEDIATE) или сводкой (DIGEST) """
+
+    serializer_class = NotificationPreferenceSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self):
+        preference, _ = NotificationPreference.objects.get_or_create(user=self.request.user)
+        return preference
+
+
 class RegistrationViewSet(ModelViewSet):
     """ ViewSet для регистрации """
 
@@ -139,11 +213,13 @@ class RegistrationViewSet(ModelViewSet):
             return RegistrationSerializer
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(IdempotentThrottleMixin, ModelViewSet):
     """ViewSet для заказов"""
 
+    pagination_class = OrderCursorPagination
+
     def get_throttles(self):
-        if self.action in ['create', 'update']:
+        if self.action in ['create', 'update', 'bulk']:
             self.throttle_scope = 'orders.' + self.action
         return super().get_throttles()
 
@@ -155,38 +231,56 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         """ Метод, который делает запрос и выводит для поставщика только то, что у него заказали, а для покупателей
-         только их заказы"""
+        только их заказы. Заказы поставщика отбираются через EXISTS по индексу позиций (provider, order) без DISTINCT
+        по соединению с позициями, поэтому и список, и проверка доступа к одному заказу читают только индексы """
         user = self.request.user
         if user.is_staff:
-            queryset = Order.objects.filter(position__provider=user.id).distinct()
-        elif user.is_authenticated and not user.is_staff:
+            provider_positions = Position.objects.filter(order=OuterRef('pk'), provider=user.id)
+            queryset = Order.objects.filter(Exists(provider_positions))
+        elif user.is_authenticated:
             queryset = Order.objects.filter(user=user.id)
-        return queryset
+        else:
+            return Order.objects.none()
+        if self.action == 'list':
+            queryset = self.filter_status(queryset)
+        return queryset.select_related('user').prefetch_related('position')
+
+    def filter_status(self, queryset):
+        """ Фильтр списка заказов по статусам: ?status=NEW,IN_PROGRESS """
+        statuses = [status for status in self.request.query_params.get('status', '').split(',') if status]
+        if not statuses:
+            return queryset
+        unknown = set(statuses) - set(OrderStatusChoices.values)
+        if unknown:
+            raise ValidationError({"status": f"Неизвестный статус: {', '.join(sorted(unknown))}"})
+        return queryset.filter(status__in=statuses)
 
     def get_permissions(self):
         """Получение прав для действий"""
-        if self.action == "create":
+        if self.action in ["create", "bulk"]:
             return [IsAuthenticated()]
         return []
 
-    @transaction.atomic
-    def retrieve(self, request, *args, **kwargs):
-        """ Метод, который не позволяет просматривать чужие заказы """
-        instance = self.get_object()
-        if not request.user.is_staff:
-            order_user = request.user
-            order_creator = instance.user
-            if order_user != order_creator:
-                return Response(data={"Order": "Просматривать можно только свои заказы!"})
-            return super().retrieve(request, *args, **kwargs)
-        else:
-            provider_order = Order.objects.filter(position__provider=request.user.id).distinct().filter(id=instance.id)
-            serializer = OrderSerializer(provider_order, many=True)
-            positions_list = [item['provider'] for item in serializer.data[0]['products_list']]
-            print(positions_list)
-            if request.user.id not in positions_list:
-                return Response(data={"Order": "Просматривать можно только заказы сделанные у Вас!"})
-            return JsonResponse(data=serializer.data, safe=False)
+    @idempotent('orders.create')
+    def create(self, request, *args, **kwargs):
+        """ Создание заказа; повтор запроса с тем же заголовком Idempotency-Key возвращает уже созданный заказ """
+        return super().create(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'])
+    @idempotent('orders.bulk')
+    def bulk(self, request):
+        """ Создание до ORDER_BULK_MAX_ORDERS заказов одним запросом: {"orders": [{"products_list": [...]}, ...]}.
+        В ответе результат по каждому заказу: id созданного заказа или ошибки """
+        orders = request.data.get('orders')
+        if not isinstance(orders, list) or not orders:
+            return Response(data={"orders": "Передайте непустой список заказов"}, status=HTTP_400_BAD_REQUEST)
+        if len(orders) > settings.ORDER_BULK_MAX_ORDERS:
+            return Response(data={"orders": f"Не больше {settings.ORDER_BULK_MAX_ORDERS} заказов в одном запросе"},
+                            status=HTTP_400_BAD_REQUEST)
+        results = BulkOrderCreator(request.user).create(orders)
+        created = sum('id' in result for result in results)
+        return Response(data={"created": created, "failed": len(results) - created, "results": results},
+                        status=HTTP_201_CREATED if created else HTTP_400_BAD_REQUEST)
 
     @transaction.atomic
     def destroy(self, request, *args, **kwargs):
@@ -211,7 +305,7 @@ class OrderViewSet(ModelViewSet):
         if user.is_staff:
             if serializer.is_valid():
                 serializer.save()
-                changed_status_message.delay(int(instance.id), int(user.id))
+                notify(instance.user, NotificationKindChoices.STATUS_CHANGED, instance)
             return JsonResponse(data=serializer.data)
         elif not user.is_superuser and user.is_authenticated:
             if request.data['status'] != 'CANCELLED':
@@ -219,7 +313,6 @@ class OrderViewSet(ModelViewSet):
             else:
                 if serializer.is_valid():
                     serializer.save()
-                    cancelled_status_message.delay(int(instance.id), int(user.id))
                 return JsonResponse(data=serializer.data)
 
 
@@ -228,3 +321,7 @@ class CategoryView(ModelViewSet):
 
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+
+    @cached_catalogue
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
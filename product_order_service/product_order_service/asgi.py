@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'product_order_service.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from order_app.events import with_event_stream  # noqa: E402 (после настройки Django)
+
+application = with_event_stream(django_application)
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -97,6 +98,21 @@ DATABASES = {
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+
+# кэш авторизации по токену: общий кэш и ограниченный кэш процесса
+AUTH_CACHE_TIMEOUT = 60 * 60
+AUTH_CACHE_LOCAL_SIZE = 10000
+AUTH_CACHE_LOCAL_TIMEOUT = 5
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -135,6 +151,9 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -142,19 +161,20 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'order_app.authentication.CachedTokenAuthentication',
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
         'rest_framework_social_oauth2.authentication.SocialAuthentication',
     ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.ScopedRateThrottle',
+        'order_app.throttling.RedisAnonRateThrottle',
+        'order_app.throttling.RedisScopedRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '60/minute',
         'orders.create': '5/day',
         'orders.update': '5/day',
+        'orders.bulk': '20/day',
         'uploads': '20/day'
     },
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -168,12 +188,78 @@ DJOSER = {
     'SERIALIZERS': {},
 }
 
+# импорт прайс-листов
+PRICE_LIST_IMPORT_CHUNK_SIZE = 1000
+PRICE_LIST_IMPORT_MAX_ACTIVE_JOBS = 1
+
+# поиск товаров
+PRODUCT_SEARCH_PAGE_SIZE = 20
+PRODUCT_SEARCH_TRIGRAM_THRESHOLD = 0.3
+PRODUCT_SEARCH_PRICE_RANGES = [(0, 1000), (1000, 10000), (10000, 50000), (50000, 100000), (100000, None)]
+
+# почта: соединения с SMTP-сервером переиспользуются пулом order_app.mail
+EMAIL_HOST = 'smtp.mail.ru'
+EMAIL_PORT = 587
+EMAIL_USE_TLS = True
+EMAIL_HOST_USER = os.getenv('MY_EMAIL')
+EMAIL_HOST_PASSWORD = os.getenv('MY_EMAIL_PASSWORD')
+EMAIL_TIMEOUT = 10
+SMTP_POOL_SIZE = 2
+SMTP_POOL_MAX_IDLE = 30
+SMTP_POOL_MAX_MESSAGES = 100
+SMTP_RETRIES = 3
+SMTP_RETRY_BACKOFF = 0.5
+
+# уведомления поставщиков: получатели со сводкой получают одно письмо за окно NOTIFICATION_DIGEST_WINDOW секунд
+NOTIFICATION_DIGEST_WINDOW = 15 * 60
+NOTIFICATION_BATCH_SIZE = 1000
+# уведомления, взятые на отправку и не отмеченные за это время (задача упала), отправляются снова
+NOTIFICATION_CLAIM_TIMEOUT = 10 * 60
+
+# ответы на запросы с заголовком Idempotency-Key хранятся сутки
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# пакетное создание заказов: заказов в одном запросе и в одной транзакции
+ORDER_BULK_MAX_ORDERS = 1000
+ORDER_BULK_CHUNK_SIZE = 100
+
+# долгий опрос статуса заказа (/api/v1/async/orders/<id>/?status=...&wait=...)
+ORDER_LONG_POLL_TIMEOUT = 60
+ORDER_LONG_POLL_INTERVAL = 1
+
+# поток событий заказов /api/v1/orders/events/
+ORDER_EVENTS_BROKER = 'order_app.events.RedisEventBroker'
+ORDER_EVENTS_REDIS_URL = 'redis://localhost:6379/3'
+ORDER_EVENTS_REDIS_TIMEOUT = 0.5
+ORDER_EVENTS_CHANNEL = 'order_events'
+ORDER_EVENTS_HISTORY = 100
+ORDER_EVENTS_HISTORY_TTL = 86400
+ORDER_EVENTS_KEEPALIVE = 15
+ORDER_EVENTS_QUEUE_SIZE = 1000
+
 # celery
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_TASK_ROUTES = {
+    'order_app.tasks.import_price_list': {'queue': 'imports'},
+}
+CELERY_BEAT_SCHEDULE = {
+    'notification-digests': {
+        'task': 'order_app.notifications.send_notification_digests',
+        'schedule': NOTIFICATION_DIGEST_WINDOW,
+    },
+    'expired-idempotency-keys': {
+        'task': 'order_app.idempotency.delete_expired_idempotency_keys',
+        'schedule': 60 * 60,
+    },
+}
+
+# ограничение частоты запросов: счётчики скользящих окон в Redis, общие для всех процессов и серверов
+THROTTLE_REDIS_URL = 'redis://localhost:6379/2'
+THROTTLE_REDIS_TIMEOUT = 0.1
 
 
 SOCIAL_AUTH_VK_OAUTH2_KEY = os.getenv('VK_APP_ID')
@@ -1,7 +1,10 @@
 import os
+from contextlib import contextmanager
 
+import fakeredis
 import pytest
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.files import File
 from django.urls import reverse
 
@@ -9,8 +12,70 @@ from rest_framework.authtoken.models import Token
 from rest_framework.status import HTTP_201_CREATED
 from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 
+from order_app import events, mail, throttling
+from order_app.authentication import local_tokens
+from order_app.management.commands.benchmark_mail import LocalSMTPServer
 from order_app.models import Product
 from order_app.views import ProductViewSet, OrderViewSet
+from product_order_service import celery_app
+
+
+@contextmanager
+def celery_eager():
+    """ Выполнение задач celery сразу в процессе теста """
+    celery_app.conf.task_always_eager = True
+    celery_app.conf.task_eager_propagates = True
+    try:
+        yield
+    finally:
+        celery_app.conf.task_always_eager = False
+        celery_app.conf.task_eager_propagates = False
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.fixture(autouse=True)
+def local_cache(settings):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    cache.clear()
+    local_tokens.clear()
+
+
+@pytest.fixture(autouse=True)
+def throttle_redis():
+    """ Счётчики ограничения частоты запросов в отдельном fakeredis для каждого теста """
+    server = fakeredis.FakeStrictRedis()
+    throttling._redis = server
+    throttling._script = server.register_script(throttling.SLIDING_WINDOW)
+    yield server
+    throttling._redis = throttling._script = None
+
+
+@pytest.fixture(autouse=True)
+def event_broker():
+    """ События заказов в брокере в памяти, отдельном для каждого теста """
+    events._broker = events.MemoryEventBroker(events.hub)
+    yield events._broker
+    events._broker = None
+
+
+@pytest.fixture
+def smtp_server(settings):
+    """ Локальный SMTP-сервер, на который отправляет письма пул соединений процесса """
+    pytest.importorskip('aiosmtpd')
+    with LocalSMTPServer() as server:
+        settings.EMAIL_HOST = '127.0.0.1'
+        settings.EMAIL_PORT = server.port
+        settings.EMAIL_USE_TLS = False
+        settings.EMAIL_HOST_USER = 'shop'
+        settings.EMAIL_HOST_PASSWORD = 'secret'
+        mail._pool = None
+        yield server
+        mail.get_pool().close()
+        mail._pool = None
 
 
 @pytest.fixture
@@ -34,7 +99,7 @@ def provider(django_user_model):
 
 @pytest.fixture()
 @pytest.mark.django_db
-def import_file_with_products(provider):
+def import_file_with_products(provider, django_capture_on_commit_callbacks):
     url = "api/v1/products"
     data = File(open('shop1.yaml'))
     factory = APIRequestFactory()
@@ -44,7 +109,8 @@ def import_file_with_products(provider):
                            content_disposition="attachment; filename=shop1.yaml",
                            HTTP_AUTHORIZATION=f'Token {provider[1]}')
     force_authenticate(request, user=provider[0], token=provider[1])
-    view(request)
+    with celery_eager(), django_capture_on_commit_callbacks(execute=True):
+        view(request)
 
 
 @pytest.fixture()
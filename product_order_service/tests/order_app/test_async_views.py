@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import AsyncClient
+
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+
+from order_app import async_views
+from order_app.models import Order, OrderStatusChoices, Product
+
+
+def auth_header(token):
+    """ Заголовок авторизации: AsyncClient в Django 3.2 передаёт дополнительные аргументы как заголовки ASGI """
+    return {'authorization': f'Token {token.key}'}
+
+
+async def async_get(path, **headers):
+    return await AsyncClient().get(path, **headers)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_catalogue_matches_sync(client, import_file_with_products):
+    """ Тест асинхронных списка и карточки товаров и списка категорий: ответы совпадают с синхронными """
+    product = Product.objects.order_by('id').first()
+    for sync_path, async_path in (('/api/v1/products/', '/api/v1/async/products/'),
+                                  (f'/api/v1/products/{product.id}/', f'/api/v1/async/products/{product.id}/'),
+                                  ('/api/v1/categories/', '/api/v1/async/categories/')):
+        response = async_to_sync(async_get)(async_path)
+        assert response.status_code == HTTP_200_OK
+        assert response.json() == client.get(sync_path).json()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_order_long_poll(create_order_by_authenticated_user, authenticated_client, settings, monkeypatch):
+    """ Тест долгого опроса статуса: ответ приходит после смены статуса, статусы всех одновременных ожидающих запросов
+    читаются одним запросом за интервал, неверное время ожидания отклоняется, чужой заказ недоступен """
+    settings.ORDER_LONG_POLL_INTERVAL = 0.05
+    status_queries = []
+    order_statuses = async_views.order_statuses
+
+    def counting_statuses(order_ids):
+        status_queries.append(order_ids)
+        return order_statuses(order_ids)
+
+    monkeypatch.setattr(async_views, 'order_statuses', counting_statuses)
+    order = Order.objects.get()
+    headers = auth_header(authenticated_client[1])
+    path = f'/api/v1/async/orders/{order.id}/'
+
+    async def change_status():
+        await asyncio.sleep(0.3)
+        await sync_to_async(Order.objects.filter(id=order.id).update, thread_sensitive=False)(
+            status=OrderStatusChoices.IN_PROGRESS
+        )
+
+    async def poll():
+        client = AsyncClient()
+        started = time.perf_counter()
+        responses = await asyncio.gather(
+            client.get(f'{path}?status=NEW&wait=5', **headers),
+            change_status(),
+        )
+        return responses[0], time.perf_counter() - started
+
+    response, elapsed = async_to_sync(poll)()
+    assert response.status_code == HTTP_200_OK
+    assert response.json()['status'] == OrderStatusChoices.IN_PROGRESS
+    assert 0.3 <= elapsed < 2
+
+    async def many_waiting():
+        client = AsyncClient()
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.get(f'{path}?status=IN_PROGRESS&wait=0.5', **headers) for _ in range(50)
+        ])
+        return responses, time.perf_counter() - started
+
+    status_queries.clear()
+    responses, elapsed = async_to_sync(many_waiting)()
+    assert all(response.status_code == HTTP_200_OK for response in responses)
+    assert elapsed < 5
+    assert 0 < len(status_queries) <= elapsed / settings.ORDER_LONG_POLL_INTERVAL + 1
+    assert all(order_ids == [order.id] for order_ids in status_queries)
+
+    for wait in ('nan', 'inf', 'abc'):
+        response = async_to_sync(async_get)(f'{path}?status=IN_PROGRESS&wait={wait}', **headers)
+        assert response.status_code == HTTP_400_BAD_REQUEST
+    status_queries.clear()
+    response = async_to_sync(async_get)(f'{path}?status=IN_PROGRESS&wait=-5', **headers)
+    assert response.status_code == HTTP_200_OK
+    assert status_queries == []
+
+    anonymous = async_to_sync(async_get)(path)
+    assert anonymous.status_code == HTTP_404_NOT_FOUND
@@ -0,0 +1,54 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.status import HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_401_UNAUTHORIZED
+from rest_framework.test import APIClient, APIRequestFactory
+
+from order_app.authentication import CachedTokenAuthentication, local_tokens
+
+
+def token_client(token):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    return client
+
+
+def authenticate(token):
+    request = APIRequestFactory().get('/api/v1/orders/', HTTP_AUTHORIZATION='Token ' + token.key)
+    return CachedTokenAuthentication().authenticate(request)
+
+
+@pytest.mark.django_db
+def test_authentication_without_queries(authenticated_client):
+    """ Тест авторизации по токену из кэша процесса и из общего кэша без запросов к базе """
+    user, token = authenticated_client
+    assert token_client(token).get('/api/v1/orders/').status_code == HTTP_200_OK
+    with CaptureQueriesContext(connection) as queries:
+        cached_user, cached_token = authenticate(token)
+        local_tokens.clear()
+        assert authenticate(token)[0] == user
+    assert len(queries) == 0
+    assert cached_user == user
+    assert (cached_user.username, cached_user.is_staff, cached_user.is_active) == ('foo', False, True)
+    assert cached_token.key == token.key
+
+
+@pytest.mark.django_db
+def test_logout_invalidates_token(authenticated_client):
+    """ Тест: после выхода токен перестаёт действовать, хотя был в кэше """
+    client = token_client(authenticated_client[1])
+    assert client.get('/api/v1/orders/').status_code == HTTP_200_OK
+    assert client.post('/api/v1/auth/token/logout/').status_code == HTTP_204_NO_CONTENT
+    assert client.get('/api/v1/orders/').status_code == HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_deactivated_user_is_rejected(authenticated_client, provider):
+    """ Тест: пользователь, заблокированный через user-info, больше не авторизуется закэшированным токеном """
+    user, token = authenticated_client
+    client = token_client(token)
+    assert client.get('/api/v1/orders/').status_code == HTTP_200_OK
+    response = token_client(provider[1]).patch(f'/api/v1/user-info/{user.id}/', {'is_active': False}, format='json')
+    assert response.status_code == HTTP_200_OK
+    assert client.get('/api/v1/orders/').status_code == HTTP_401_UNAUTHORIZED
@@ -0,0 +1,74 @@
+from email import message_from_bytes, policy
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.status import HTTP_201_CREATED
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from order_app.models import Notification, Order, Price, ProviderSalesSummary
+from order_app.notifications import send_notification_digests
+from order_app.views import OrderViewSet
+from tests.conftest import celery_eager
+
+
+def position(external_id, quantity):
+    price = Price.objects.get(external_id=external_id)
+    return {"product": price.product_id, "provider": price.provider_id, "quantity": quantity}
+
+
+def post_bulk(user, token, orders):
+    request = APIRequestFactory().post('/api/v1/orders/bulk/', {"orders": orders}, format='json')
+    force_authenticate(request, user=user, token=token)
+    return OrderViewSet.as_view({'post': 'bulk'})(request)
+
+
+@pytest.mark.django_db
+def test_bulk_orders_report_each_order(authenticated_client, import_file_with_products, smtp_server, settings,
+                                       django_capture_on_commit_callbacks):
+    """ Тест пакетного создания: правильные заказы создаются частями, ошибочные и не уместившиеся в остаток
+    отклоняются с ошибкой в результате, покупатель и поставщик получают по одному письму на пачку """
+    settings.ORDER_BULK_CHUNK_SIZE = 2
+    User.objects.filter(username__in=["foo", "Связной"]).update(email='user@example.com')
+    orders = [
+        {"products_list": [position(4216292, 10), position(4216313, 1)]},
+        {"products_list": [{"product": 0, "provider": 0, "quantity": 1}]},
+        {"products_list": [position(4216292, 5)]},
+        {"products_list": [position(4216292, 4)]},
+        {"products_list": "нет позиций"},
+    ]
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = post_bulk(*authenticated_client, orders)
+    assert response.status_code == HTTP_201_CREATED
+    assert (response.data['created'], response.data['failed']) == (2, 3)
+    results = response.data['results']
+    assert [result['index'] for result in results] == [0, 1, 2, 3, 4]
+    assert 'Price' in results[1]['errors']
+    assert 'Stock' in results[2]['errors']
+    assert 'products_list' in results[4]['errors']
+    assert Order.objects.count() == 2
+    assert Order.objects.get(id=results[0]['id']).count == 11
+    assert Price.objects.get(external_id=4216292).quantity == 0
+    assert ProviderSalesSummary.objects.get().orders == 2
+
+    with celery_eager():
+        for callback in callbacks:
+            callback()
+    send_notification_digests()
+    subjects = sorted(message_from_bytes(raw, policy=policy.default)['Subject'] for raw in smtp_server.messages)
+    assert subjects == ["Заказы: 2 событий", "Подтверждение заказов: 2"]
+    assert not Notification.objects.filter(sent_at__isnull=True, recipient__username="foo").exists()
+
+
+@pytest.mark.django_db
+def test_bulk_orders_query_count_does_not_grow(authenticated_client, import_file_with_products):
+    """ Тест: число запросов пачки в одной части не зависит от числа заказов """
+    query_counts = []
+    for count in (1, 5):
+        with CaptureQueriesContext(connection) as queries:
+            response = post_bulk(*authenticated_client, [{"products_list": [position(4672670, 1)]}] * count)
+        assert response.data['created'] == count
+        query_counts.append(len(queries))
+    assert query_counts[0] == query_counts[1]
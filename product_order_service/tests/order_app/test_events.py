@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection
+
+from rest_framework.status import HTTP_200_OK
+from rest_framework.test import APIClient
+
+from order_app.events import EVENTS_PATH, EventHub, RedisEventBroker, with_event_stream
+from order_app.models import Order, OrderStatusChoices
+
+
+async def not_found(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+class EventStreamClient:
+    """ Соединение с потоком событий через ASGI-приложение без сервера """
+
+    def __init__(self, token=None, last_event_id=None, method='GET'):
+        headers = []
+        if token is not None:
+            headers.append((b'authorization', f'Token {token.key}'.encode()))
+        if last_event_id is not None:
+            headers.append((b'last-event-id', str(last_event_id).encode()))
+        scope = {'type': 'http', 'method': method, 'path': EVENTS_PATH, 'headers': headers, 'query_string': b''}
+        self.inbox = asyncio.Queue()
+        self.messages = asyncio.Queue()
+        self.task = asyncio.ensure_future(with_event_stream(not_found)(scope, self.inbox.get, self.messages.put))
+
+    async def start(self):
+        return await asyncio.wait_for(self.messages.get(), 5)
+
+    async def event(self):
+        """ Следующее событие, комментарии и retry пропускаются """
+        while True:
+            message = await asyncio.wait_for(self.messages.get(), 5)
+            fields = dict(line.split(': ', 1) for line in message['body'].decode().splitlines() if ': ' in line)
+            if 'data' in fields:
+                return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+    async def close(self):
+        await self.inbox.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+def patch_status(token, order_id, status):
+    """ Смена статуса в потоке пула; соединение потока с базой закрывается, иначе тестовую базу не удалить """
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    try:
+        return client.patch(f'/api/v1/orders/{order_id}/', {"status": status}, format='json')
+    finally:
+        connection.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_status_events_stream(create_order_by_authenticated_user, authenticated_client, provider):
+    """ Тест потока событий: покупатель и поставщик получают смену статуса после фиксации, поток продолжается с
+    Last-Event-ID, без токена поток недоступен """
+    order = Order.objects.get()
+    buyer_token, provider_token = authenticated_client[1], provider[1]
+    change_status = sync_to_async(patch_status, thread_sensitive=False)
+
+    async def scenario():
+        buyer, supplier = EventStreamClient(buyer_token), EventStreamClient(provider_token)
+        start = await buyer.start()
+        assert start['status'] == HTTP_200_OK
+        assert (b'content-type', b'text/event-stream; charset=utf-8') in start['headers']
+        await supplier.start()
+        await asyncio.sleep(0.1)
+
+        response = await change_status(provider_token, order.id, OrderStatusChoices.IN_PROGRESS)
+        assert response.status_code == HTTP_200_OK
+        first = await buyer.event()
+        assert first[1:] == ('status', {'order': order.id, 'status': 'IN_PROGRESS', 'previous': 'NEW'})
+        assert await supplier.event() == first
+
+        await buyer.close()
+        response = await change_status(buyer_token, order.id, OrderStatusChoices.CANCELLED)
+        assert response.status_code == HTTP_200_OK
+        second = await supplier.event()
+        assert second[2] == {'order': order.id, 'status': 'CANCELLED', 'previous': 'IN_PROGRESS'}
+        await supplier.close()
+
+        resumed = EventStreamClient(buyer_token, last_event_id=first[0])
+        await resumed.start()
+        assert await resumed.event() == second
+        await resumed.close()
+
+        anonymous = EventStreamClient()
+        assert (await anonymous.start())['status'] == 401
+        await anonymous.task
+        assert (await EventStreamClient(buyer_token, method='POST').start())['status'] == 405
+
+    async_to_sync(scenario)()
+
+
+def test_redis_broker_publishes_history_and_fans_out(settings):
+    """ Тест брокера на Redis: события хранятся в истории получателей не больше ORDER_EVENTS_HISTORY и доходят до
+    соединений процесса через подписку на канал """
+    settings.ORDER_EVENTS_HISTORY = 2
+    server = fakeredis.FakeServer()
+    hub = EventHub()
+    broker = RedisEventBroker(hub, fakeredis.FakeStrictRedis(server=server), fakeredis.FakeStrictRedis(server=server))
+
+    async def scenario():
+        buyer = hub.subscribe(1)
+        broker.start()
+        await asyncio.sleep(0.2)
+        ids = [broker.publish([1, 2], 'status', {'order': number}) for number in range(3)]
+        received = [await asyncio.wait_for(buyer.queue.get(), 5) for _ in ids]
+        hub.unsubscribe(1, buyer)
+        return ids, received
+
+    ids, received = async_to_sync(scenario)()
+    assert [event['id'] for event in received] == ids
+    assert received[0] == {'id': ids[0], 'event': 'status', 'data': {'order': 0}}
+    assert [event['data']['order'] for event in broker.history(2, 0)] == [1, 2]
+    assert broker.history(1, ids[1]) == received[2:]
@@ -0,0 +1,102 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.status import HTTP_201_CREATED, HTTP_422_UNPROCESSABLE_ENTITY, HTTP_429_TOO_MANY_REQUESTS
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from order_app.idempotency import delete_expired_idempotency_keys
+from order_app.models import IdempotencyKey, Notification, Order, Price
+from order_app.views import OrderViewSet
+
+
+def order_data(quantity=1):
+    provider = User.objects.get(username="Связной")
+    price = Price.objects.filter(provider=provider).order_by('id').first()
+    return {"products_list": [{"product": price.product_id, "provider": provider.id, "quantity": quantity}]}
+
+
+def post_order(user, token, data, key):
+    request = APIRequestFactory().post(reverse("orders-list"), data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    force_authenticate(request, user=user, token=token)
+    return OrderViewSet.as_view({'post': 'create'})(request)
+
+
+@pytest.mark.django_db
+def test_retry_returns_stored_order(authenticated_client, import_file_with_products):
+    """ Тест повтора запроса с тем же ключом: заказ создаётся один раз, повтор получает тот же ответ одним запросом к
+    базе, другой ключ создаёт новый заказ, а тот же ключ с другими данными отклоняется """
+    data = order_data()
+    first = post_order(*authenticated_client, data, 'retry-1')
+    assert first.status_code == HTTP_201_CREATED
+    notifications = Notification.objects.count()
+
+    with CaptureQueriesContext(connection) as queries:
+        retry = post_order(*authenticated_client, data, 'retry-1')
+    assert retry.status_code == HTTP_201_CREATED
+    assert retry['Idempotent-Replayed'] == 'true'
+    assert retry.data == first.data
+    assert len([query for query in queries if query['sql'].startswith('SELECT')]) == 1
+    assert Order.objects.count() == 1
+    assert Notification.objects.count() == notifications
+
+    assert post_order(*authenticated_client, data, 'retry-2').status_code == HTTP_201_CREATED
+    assert Order.objects.count() == 2
+    response = post_order(*authenticated_client, order_data(quantity=2), 'retry-1')
+    assert response.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.django_db
+def test_retries_do_not_use_up_rate_limit(authenticated_client, import_file_with_products):
+    """ Тест: повторы выполненного запроса не расходуют лимит частоты создания заказов (5/day), новые запросы -
+    расходуют """
+    data = order_data()
+    assert post_order(*authenticated_client, data, 'flaky').status_code == HTTP_201_CREATED
+    for _ in range(10):
+        retry = post_order(*authenticated_client, data, 'flaky')
+        assert retry.status_code == HTTP_201_CREATED
+        assert retry['Idempotent-Replayed'] == 'true'
+    for number in range(4):
+        assert post_order(*authenticated_client, data, f'new-{number}').status_code == HTTP_201_CREATED
+    assert post_order(*authenticated_client, data, 'over-limit').status_code == HTTP_429_TOO_MANY_REQUESTS
+    assert Order.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_expired_keys_are_deleted(authenticated_client, import_file_with_products, settings):
+    """ Тест удаления ключей старше IDEMPOTENCY_KEY_TTL """
+    post_order(*authenticated_client, order_data(), 'old')
+    post_order(*authenticated_client, order_data(), 'new')
+    IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+    delete_expired_idempotency_keys()
+    assert list(IdempotencyKey.objects.values_list('key', flat=True)) == ['new']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_duplicates_create_one_order(authenticated_client, import_file_with_products):
+    """ Тест одновременных повторов: запросы с одним ключом ждут первый запрос и получают его заказ """
+    data = order_data()
+    barrier = threading.Barrier(5)
+    responses = []
+
+    def post():
+        try:
+            barrier.wait()
+            responses.append(post_order(*authenticated_client, data, 'concurrent'))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=post) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert Order.objects.count() == 1
+    assert [response.status_code for response in responses] == [HTTP_201_CREATED] * 5
+    assert {response.data['id'] for response in responses} == {Order.objects.get().id}
@@ -0,0 +1,49 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from order_app.models import Order, Position, Price, Product
+from order_app.views import OrderViewSet
+
+
+def query_plan(queryset):
+    """ План запроса при запрещённом последовательном чтении: Seq Scan в нём останется, только если подходящего
+    индекса нет, поэтому проверка не зависит от объёма тестовых данных """
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    try:
+        return queryset.explain()
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = on')
+
+
+def orders_queryset(user, query=''):
+    """ Запрос списка заказов, который выполняет OrderViewSet для пользователя """
+    request = Request(APIRequestFactory().get(f'/api/v1/orders/{query}'))
+    request.user = user
+    return OrderViewSet(request=request, action='list', format_kwarg=None).get_queryset()
+
+
+@pytest.mark.django_db
+def test_hot_path_queries_use_indexes(create_order_by_authenticated_user):
+    """ Тест использования индексов запросами списка заказов, рассылки писем и импорта прайс-листа: в плане каждого
+    запроса - свой индекс и нет Seq Scan """
+    provider = User.objects.get(username="Связной")
+    order = Order.objects.get()
+    product = Product.objects.first()
+    queries = {
+        'заказы поставщика': (orders_queryset(provider), 'position_provider_order_idx'),
+        'заказы покупателя': (orders_queryset(order.user, '?status=NEW'), 'order_user_status_idx'),
+        'позиции заказа': (Position.objects.filter(order_id=order.id), 'order_id'),
+        'товары по названию': (Product.objects.filter(name__in=[product.name]).only('id', 'name'),
+                               'product_name_idx'),
+        'цена поставщика': (Price.objects.filter(product=product, provider=provider), 'unique_product_provider'),
+    }
+    for name, (queryset, index) in queries.items():
+        plan = query_plan(queryset)
+        assert 'Seq Scan' not in plan, f'{name}:\n{plan}'
+        assert index in plan, f'{name}:\n{plan}'
@@ -0,0 +1,61 @@
+import socket
+import time
+
+import pytest
+
+from order_app.management.commands.benchmark_mail import LocalSMTPServer, make_message
+
+pytest.importorskip('aiosmtpd')
+
+
+def test_pool_reuses_authenticated_connection():
+    """ Тест переиспользования одного авторизованного соединения несколькими отправками """
+    with LocalSMTPServer() as server:
+        pool = server.pool()
+        for number in range(3):
+            assert pool.send_messages([make_message(number * 2), make_message(number * 2 + 1)]) == 2
+        pool.close()
+    assert len(server.messages) == 6
+    assert server.connections == 1
+    assert server.logins == 1
+
+
+def test_pool_limits_messages_per_connection():
+    """ Тест переподключения после max_messages писем по одному соединению """
+    with LocalSMTPServer() as server:
+        pool = server.pool(max_messages=2)
+        assert pool.send_messages([make_message(number) for number in range(5)]) == 5
+        pool.close()
+    assert server.connections == 3
+
+
+def test_pool_retries_transient_errors():
+    """ Тест повторной отправки с задержкой после временной ошибки 451 """
+    with LocalSMTPServer(fail_first=2) as server:
+        pool = server.pool(backoff=0.01)
+        assert pool.send_messages([make_message(1)]) == 1
+        pool.close()
+    assert len(server.messages) == 1
+    assert server.connections == 3
+
+
+def test_pool_gives_up_after_retries():
+    """ Тест пропуска письма после исчерпания повторов без остановки пачки """
+    with LocalSMTPServer(fail_first=2) as server:
+        pool = server.pool(retries=1, backoff=0.01)
+        assert pool.send_messages([make_message(1), make_message(2)]) == 1
+        pool.close()
+    assert len(server.messages) == 1
+
+
+def test_pool_checks_idle_connection_health():
+    """ Тест проверки простаивавшего соединения командой NOOP и переподключения, если сервер его закрыл """
+    with LocalSMTPServer() as server:
+        pool = server.pool(max_idle=0)
+        pool.send_messages([make_message(1)])
+        pool._idle.queue[0].sock.shutdown(socket.SHUT_RDWR)
+        time.sleep(0.01)
+        assert pool.send_messages([make_message(2)]) == 1
+        pool.close()
+    assert len(server.messages) == 2
+    assert server.connections == 2
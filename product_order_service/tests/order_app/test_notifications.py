@@ -0,0 +1,178 @@
+import threading
+from datetime import timedelta
+from email import message_from_bytes, policy
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from order_app import notifications
+from order_app.models import Notification, NotificationKindChoices, Price
+from order_app.management.commands.benchmark_notifications import create_confirmations
+from order_app.notifications import (flush_outbox, load_pending, render_pending, send_notification_digests,
+                                     send_notifications)
+from order_app.views import OrderViewSet, NotificationPreferenceViewSet
+from tests.conftest import celery_eager
+
+
+def text_body(raw):
+    """ Текстовая часть письма, полученного SMTP-сервером """
+    return message_from_bytes(raw, policy=policy.default).get_body(('plain',)).get_content()
+
+
+def create_order(user, token, quantity=1):
+    provider = User.objects.get(username="Связной")
+    price = Price.objects.filter(provider=provider).order_by('id').first()
+    order = {"products_list": [{"product": price.product_id, "provider": provider.id, "quantity": quantity}]}
+    request = APIRequestFactory().post(reverse("orders-list"), order, format='json')
+    force_authenticate(request, user=user, token=token)
+    response = OrderViewSet.as_view({'post': 'create'})(request)
+    assert response.status_code == HTTP_201_CREATED
+    return response.data['id']
+
+
+def cancel_order(user, token, order_id):
+    request = APIRequestFactory().patch('/', {"status": "CANCELLED"}, format='json')
+    force_authenticate(request, user=user, token=token)
+    assert OrderViewSet.as_view({'patch': 'partial_update'})(request, pk=order_id).status_code == HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_provider_notifications_are_sent_as_digest(authenticated_client, import_file_with_products, smtp_server):
+    """ Тест сводки: события заказов копятся в outbox, поставщик получает одно письмо со всеми номерами заказов """
+    User.objects.filter(username="Связной").update(email='provider@example.com')
+    orders = [create_order(*authenticated_client) for _ in range(3)]
+    cancel_order(*authenticated_client, orders[0])
+    assert Notification.objects.filter(recipient__username="Связной", sent_at__isnull=True).count() == 4
+    assert smtp_server.messages == []
+
+    send_notification_digests()
+    assert len(smtp_server.messages) == 1
+    digest = text_body(smtp_server.messages[0])
+    assert f"Новый заказ: {', '.join(f'№{number}' for number in orders)}" in digest
+    assert f"Заказ отменён: №{orders[0]}" in digest
+    assert not Notification.objects.filter(sent_at__isnull=True).exists()
+
+    send_notification_digests()
+    assert len(smtp_server.messages) == 1
+
+
+@pytest.mark.django_db
+def test_immediate_notifications_after_commit(authenticated_client, provider, import_file_with_products,
+                                              smtp_server, django_capture_on_commit_callbacks):
+    """ Тест доставки "сразу": уведомление отправляется задачей после фиксации транзакции заказа """
+    User.objects.filter(username="Связной").update(email='provider@example.com')
+    request = APIRequestFactory().patch('/api/v1/notification-settings/', {'delivery': 'IMMEDIATE'}, format='json')
+    force_authenticate(request, user=provider[0], token=provider[1])
+    response = NotificationPreferenceViewSet.as_view({'patch': 'partial_update'})(request)
+    assert response.data == {'delivery': 'IMMEDIATE'}
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        order_id = create_order(*authenticated_client)
+    assert smtp_server.messages == []
+    assert Notification.objects.filter(order=order_id, sent_at__isnull=True).count() == 2
+    with celery_eager():
+        for callback in callbacks:
+            callback()
+    assert len(smtp_server.messages) == 1
+    notification = Notification.objects.get(recipient=provider[0])
+    assert notification.kind == NotificationKindChoices.NEW_ORDER
+    assert notification.sent_at is not None
+
+
+@pytest.mark.django_db
+def test_outbox_sends_after_commit(authenticated_client, import_file_with_products, smtp_server,
+                                   django_capture_on_commit_callbacks):
+    """ Тест outbox: письмо покупателю записывается в транзакции заказа и отправляется только после её фиксации,
+    задача получает только id уведомлений и загружает данные пачки постоянным числом запросов """
+    User.objects.filter(username="foo").update(email='buyer@example.com')
+    with django_capture_on_commit_callbacks() as callbacks:
+        order_id = create_order(*authenticated_client, quantity=2)
+    assert callbacks.count(flush_outbox) == 1
+    assert smtp_server.messages == []
+    with celery_eager():
+        for callback in callbacks:
+            callback()
+    assert len(smtp_server.messages) == 1
+    confirmation = message_from_bytes(smtp_server.messages[0])
+    assert confirmation['To'] == 'buyer@example.com'
+    assert f"№: {order_id}" in text_body(smtp_server.messages[0])
+
+    query_counts = []
+    for orders in (1, 3):
+        with django_capture_on_commit_callbacks():
+            ids = [create_order(*authenticated_client) for _ in range(orders)]
+        with CaptureQueriesContext(connection) as queries:
+            send_notifications(list(Notification.objects.filter(order__in=ids).values_list('id', flat=True)))
+        query_counts.append(len(queries))
+    assert query_counts[0] == query_counts[1]
+    assert len(smtp_server.messages) == 3
+    assert message_from_bytes(smtp_server.messages[-1], policy=policy.default)['Subject'] == "Подтверждение заказов: 3"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_delivery_outside_transaction(monkeypatch, settings):
+    """ Тест: письма отправляются без открытой транзакции и блокировок строк, уведомления взяты на отправку, а
+    неотправленные и взятые упавшей задачей отправляются снова """
+    create_confirmations(3, positions=1)
+    ids = list(Notification.objects.order_by('id').values_list('id', flat=True))
+    during = {}
+
+    def probe():
+        try:
+            with transaction.atomic():
+                during['claimed'] = list(Notification.objects.select_for_update(nowait=True).filter(id__in=ids)
+                                         .values_list('claimed_at', flat=True))
+        finally:
+            connection.close()
+
+    def flaky_deliver(messages):
+        during['in_transaction'] = connection.in_atomic_block
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        return [True, False, True]
+
+    monkeypatch.setattr(notifications, 'deliver', flaky_deliver)
+    send_notifications(ids)
+    assert during['in_transaction'] is False
+    assert len(during['claimed']) == 3 and None not in during['claimed']
+    states = list(Notification.objects.order_by('id').values_list('sent_at', 'claimed_at'))
+    assert [sent_at is not None for sent_at, _ in states] == [True, False, True]
+    assert states[1][1] is None
+
+    monkeypatch.setattr(notifications, 'deliver', lambda messages: [True] * len(messages))
+    Notification.objects.filter(id=ids[1]).update(claimed_at=timezone.now())
+    send_notifications(ids)
+    assert Notification.objects.get(id=ids[1]).sent_at is None
+    Notification.objects.filter(id=ids[1]).update(
+        claimed_at=timezone.now() - timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT + 1)
+    )
+    send_notifications(ids)
+    assert not Notification.objects.filter(sent_at__isnull=True).exists()
+
+
+@pytest.mark.django_db
+def test_emails_render_without_queries():
+    """ Тест отрисовки писем: все данные пачки загружаются заранее постоянным числом запросов, шаблоны не делают
+    запросов к базе, письмо содержит текстовую и HTML части со списком позиций заказа """
+    create_confirmations(20, positions=2)
+    notifications = load_pending(Notification.objects.all())
+    with CaptureQueriesContext(connection) as queries:
+        messages, groups, skipped = render_pending(notifications)
+    assert len(queries) == 0
+    assert len(messages) == 20
+    assert skipped == []
+    message = message_from_bytes(messages[0].as_bytes(), policy=policy.default)
+    text = message.get_body(('plain',)).get_content()
+    html = message.get_body(('html',)).get_content()
+    assert f"№: {notifications[0].order_id} на сумму 200.00" in text
+    assert "товар: Товар 0, количество: 1" in text
+    assert "товар: Товар 1, количество: 1" in text
+    assert "<td>Товар 1</td>" in html
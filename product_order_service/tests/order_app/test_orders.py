@@ -1,12 +1,26 @@
+import threading
+from decimal import Decimal
+from io import StringIO
+
 import pytest
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from rest_framework.exceptions import ValidationError
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST, \
+    HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
 from rest_framework.test import APIRequestFactory, force_authenticate
 
-from order_app.models import Product, Order
-from order_app.views import OrderViewSet
+from order_app.importer import PriceListImporter
+from order_app.models import Product, Order, OrderStatusChoices, Price, SalesSummary
+from order_app.price_list import PriceListReader
+from order_app.stock import reserve_stock
+from order_app.views import OrderViewSet, AnalyticsViewSet
 
 
 @pytest.mark.django_db
@@ -77,3 +91,241 @@ def test_get_list_of_orders_by_authenticated_client(create_order_by_authenticate
     force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
     response = view(request)
     assert response.status_code == HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_create_order_query_count_does_not_depend_on_positions(authenticated_client, import_file_with_products):
+    """ Тест постоянного числа запросов при создании заказа с разным количеством позиций """
+    factory = APIRequestFactory()
+    provider = User.objects.get(username="Связной")
+    view = OrderViewSet.as_view({'post': 'create'})
+    query_counts = []
+    for products in (Product.objects.all()[:1], Product.objects.all()):
+        order = {"products_list": [{"product": product.id, "provider": provider.id, "quantity": 1}
+                                   for product in products]}
+        request = factory.post(reverse("orders-list"), order, format='json')
+        force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+        assert response.status_code == HTTP_201_CREATED
+        query_counts.append(len(queries))
+    assert query_counts[0] == query_counts[1]
+    order = Order.objects.get(id=response.data['id'])
+    assert order.count == 4
+    assert order.position.count() == 4
+
+
+@pytest.mark.django_db
+def test_create_order_with_unknown_price(authenticated_client, import_file_with_products):
+    """ Тест отказа в заказе товара, который не продаётся у поставщика, без записи заказа """
+    factory = APIRequestFactory()
+    provider = User.objects.get(username="Связной")
+    order = {"products_list": [{"product": Product.objects.first().id, "provider": provider.id, "quantity": 1},
+                               {"product": 0, "provider": provider.id, "quantity": 1}]}
+    request = factory.post(reverse("orders-list"), order, format='json')
+    force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+    response = OrderViewSet.as_view({'post': 'create'})(request)
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_order_totals_are_exact_decimals(authenticated_client, import_file_with_products):
+    """ Тест фиксации цены и суммы позиций при заказе и точной суммы заказа в Decimal """
+    provider = User.objects.get(username="Связной")
+    prices = list(Price.objects.filter(provider=provider).order_by('id')[:2])
+    Price.objects.filter(id=prices[0].id).update(price=Decimal('0.10'))
+    Price.objects.filter(id=prices[1].id).update(price=Decimal('0.20'))
+    order = {"products_list": [{"product": price.product_id, "provider": provider.id, "quantity": 3}
+                               for price in prices]}
+    request = APIRequestFactory().post(reverse("orders-list"), order, format='json')
+    force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+    response = OrderViewSet.as_view({'post': 'create'})(request)
+    assert response.status_code == HTTP_201_CREATED
+    order = Order.objects.get(id=response.data['id'])
+    assert order.total == Decimal('0.90')
+    assert sorted(order.position.values_list('price', 'total')) == [(Decimal('0.10'), Decimal('0.30')),
+                                                                     (Decimal('0.20'), Decimal('0.60'))]
+    assert Order.objects.aggregate(revenue=Sum('total'))['revenue'] == Decimal('0.90')
+
+
+@pytest.mark.django_db
+def test_order_reserves_and_cancel_releases_stock(authenticated_client, import_file_with_products):
+    """ Тест резервирования остатков при заказе, отказа при нехватке и возврата остатков при отмене """
+    provider = User.objects.get(username="Связной")
+    price = Price.objects.get(provider=provider, external_id=4216292)
+    assert price.quantity == 14
+    view = OrderViewSet.as_view({'post': 'create'})
+
+    def create_order(quantity):
+        order = {"products_list": [{"product": price.product_id, "provider": provider.id, "quantity": quantity}]}
+        request = APIRequestFactory().post(reverse("orders-list"), order, format='json')
+        force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+        return view(request)
+
+    response = create_order(10)
+    assert response.status_code == HTTP_201_CREATED
+    price.refresh_from_db()
+    assert price.quantity == 4
+    assert create_order(5).status_code == HTTP_400_BAD_REQUEST
+    assert Order.objects.count() == 1
+    price.refresh_from_db()
+    assert price.quantity == 4
+
+    for _ in range(2):
+        request = APIRequestFactory().patch('/', {"status": "CANCELLED"}, format='json')
+        force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+        assert OrderViewSet.as_view({'patch': 'partial_update'})(request, pk=response.data['id']).status_code == HTTP_200_OK
+    price.refresh_from_db()
+    assert price.quantity == 14
+
+
+def reimport(provider, change=None):
+    """ Повторный импорт shop1.yaml, change - изменения товара 4216292 """
+    with open('shop1.yaml', 'rb') as stream:
+        price_list = PriceListReader(stream).read_header()
+        importer = PriceListImporter(provider)
+        importer.import_categories(price_list.categories)
+        goods = list(price_list.goods())
+    for item in goods:
+        if item['id'] == 4216292:
+            item.update(change or {})
+    importer.import_goods(goods)
+    importer.finish()
+    return importer
+
+
+@pytest.mark.django_db
+def test_reimport_keeps_reservations_of_open_orders(authenticated_client, import_file_with_products):
+    """ Тест остатка при повторном импорте: резерв новых и выполняемых заказов вычитается из остатка прайс-листа и
+    для неизменившихся, и для изменившихся товаров, резерв выполненных заказов - нет; цены без учёта остатка не
+    ограничивают заказ """
+    provider = User.objects.get(username="Связной")
+    price = Price.objects.get(provider=provider, external_id=4216292)
+    order = {"products_list": [{"product": price.product_id, "provider": provider.id, "quantity": 3}]}
+    request = APIRequestFactory().post(reverse("orders-list"), order, format='json')
+    force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+    order_id = OrderViewSet.as_view({'post': 'create'})(request).data['id']
+
+    Price.objects.filter(id=price.id).update(quantity=0)
+    assert reimport(provider).report['changed'] == []
+    price.refresh_from_db()
+    assert price.quantity == 11
+    assert reimport(provider, {'quantity': 20}).report['changed'] == [4216292]
+    price.refresh_from_db()
+    assert price.quantity == 17
+    Order.objects.filter(id=order_id).update(status=OrderStatusChoices.DONE)
+    reimport(provider, {'quantity': 20, 'price': 1})
+    price.refresh_from_db()
+    assert price.quantity == 20
+
+    Price.objects.filter(id=price.id).update(quantity=None)
+    reserve_stock({price.id: 100})
+    price.refresh_from_db()
+    assert price.quantity is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_reservations_do_not_oversell(import_file_with_products):
+    """ Тест одновременного резервирования одного товара: продаётся ровно столько, сколько есть на складе """
+    price = Price.objects.get(external_id=4216292)
+    barrier = threading.Barrier(30)
+    results = []
+
+    def buy():
+        try:
+            barrier.wait()
+            with transaction.atomic():
+                reserve_stock({price.id: 1})
+            results.append(True)
+        except ValidationError:
+            results.append(False)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy) for _ in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    price.refresh_from_db()
+    assert results.count(True) == 14
+    assert price.quantity == 0
+
+
+@pytest.mark.django_db
+def test_provider_order_inbox(create_order_by_authenticated_user, provider, django_user_model):
+    """ Тест списка и просмотра заказов поставщиком: EXISTS вместо DISTINCT, фильтр по статусу, курсорная пагинация
+    и 404 на заказы других поставщиков """
+    factory = APIRequestFactory()
+    order = Order.objects.get()
+    view = OrderViewSet.as_view({'get': 'list'})
+
+    def inbox(user, token, **params):
+        request = factory.get(reverse("orders-list"), params)
+        force_authenticate(request, user=user, token=token)
+        return view(request)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = inbox(*provider, status='NEW,IN_PROGRESS', page_size=1)
+    assert response.status_code == HTTP_200_OK
+    assert [item['id'] for item in response.data['results']] == [order.id]
+    assert len(response.data['results'][0]['products_list']) == 2
+    assert len(queries) == 2
+    assert 'DISTINCT' not in queries[0]['sql']
+    assert inbox(*provider, status='DONE').data['results'] == []
+    assert inbox(*provider, status='UNKNOWN').status_code == HTTP_400_BAD_REQUEST
+
+    request = factory.get(reverse('orders-detail', args=(order.id,)))
+    force_authenticate(request, user=provider[0], token=provider[1])
+    response = OrderViewSet.as_view({'get': 'retrieve'})(request, pk=order.id)
+    assert response.status_code == HTTP_200_OK
+    assert response.data['id'] == order.id
+
+    other = django_user_model.objects.create_user(username='other', password='other', is_staff=True)
+    request = factory.get(reverse('orders-detail', args=(order.id,)))
+    force_authenticate(request, user=other)
+    assert OrderViewSet.as_view({'get': 'retrieve'})(request, pk=order.id).status_code == HTTP_404_NOT_FOUND
+    assert inbox(other, None).data['results'] == []
+
+
+@pytest.mark.django_db
+def test_sales_analytics(create_order_by_authenticated_user, provider, authenticated_client):
+    """ Тест пополнения сводок продаж при заказе и отмене, их пересборки командой и отчёта /api/v1/analytics/ """
+    factory = APIRequestFactory()
+    view = AnalyticsViewSet.as_view({'get': 'list'})
+
+    def report(**params):
+        request = factory.get('/api/v1/analytics/', params)
+        force_authenticate(request, user=provider[0], token=provider[1])
+        return view(request)
+
+    order = Order.objects.get()
+    response = report()
+    assert response.status_code == HTTP_200_OK
+    assert response.data == [{'day': timezone.localdate(order.created_at), 'units': 5, 'revenue': order.total,
+                              'orders': 1}]
+    by_product = report(group_by='product')
+    assert sorted(row['units'] for row in by_product.data) == [2, 3]
+    assert all(row['orders'] == 1 for row in by_product.data)
+    assert report(group_by='category').data[0]['units'] == 5
+    assert report(group_by='month').status_code == HTTP_400_BAD_REQUEST
+    incremental = list(SalesSummary.objects.values_list('product', 'day', 'units', 'revenue', 'orders').order_by('id'))
+    call_command('rebuild_sales_summary', stdout=StringIO())
+    assert list(SalesSummary.objects.values_list('product', 'day', 'units', 'revenue', 'orders')
+                .order_by('id')) == incremental
+    Order.objects.filter(id=order.id).update(created_at=None)
+    call_command('rebuild_sales_summary', stdout=StringIO())
+    assert report().data == []
+    Order.objects.filter(id=order.id).update(created_at=order.created_at)
+    call_command('rebuild_sales_summary', stdout=StringIO())
+
+    request = factory.patch('/', {"status": "CANCELLED"}, format='json')
+    force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+    assert OrderViewSet.as_view({'patch': 'partial_update'})(request, pk=order.id).status_code == HTTP_200_OK
+    assert report().data == []
+    assert report(group_by='product,day').data == []
+
+    request = factory.get('/api/v1/analytics/')
+    force_authenticate(request, user=authenticated_client[0], token=authenticated_client[1])
+    assert view(request).status_code == HTTP_403_FORBIDDEN
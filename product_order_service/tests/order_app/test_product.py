@@ -1,17 +1,27 @@
+import io
+
 import pytest
+import yaml
 
 from django.core.files import File
+from django.db import connection, DatabaseError
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from rest_framework.status import HTTP_200_OK
+from rest_framework.status import HTTP_200_OK, HTTP_202_ACCEPTED, HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST, \
+    HTTP_429_TOO_MANY_REQUESTS
 from rest_framework.test import APIRequestFactory, force_authenticate
 
-from order_app.models import Product
-from order_app.views import ProductViewSet
+from order_app.importer import PriceListImporter
+from order_app.management.commands.benchmark_import import generate_goods
+from order_app.models import Product, Price, ImportJob, ImportStatusChoices
+from order_app.price_list import PriceListReader
+from order_app.views import ProductViewSet, ImportJobViewSet
+from tests.conftest import celery_eager
 
 
 @pytest.mark.django_db
-def test_import_file(provider):
+def test_import_file(provider, django_capture_on_commit_callbacks):
     """ Тест импорта файла  """
     url = reverse("products-list")
     data = File(open('shop1.yaml'))
@@ -22,8 +32,33 @@ def test_import_file(provider):
                            content_disposition="attachment; filename=shop1.yaml",
                            HTTP_AUTHORIZATION=f'Token {provider[1]}')
     force_authenticate(request, user=provider[0], token=provider[1])
-    response = view(request)
+    with celery_eager(), django_capture_on_commit_callbacks(execute=True):
+        response = view(request)
+    assert response.status_code == HTTP_202_ACCEPTED
+    assert response.data['status'] == ImportStatusChoices.PENDING
+
+    view = ImportJobViewSet.as_view({'get': 'retrieve'})
+    request = factory.get(f'/api/v1/imports/{response.data["id"]}/')
+    force_authenticate(request, user=provider[0], token=provider[1])
+    response = view(request, pk=response.data['id'])
     assert response.status_code == HTTP_200_OK
+    assert response.data['status'] == ImportStatusChoices.DONE
+    assert response.data['processed'] == 4
+    assert response.data['inserted'] == 4
+    assert response.data['failed'] == 0
+    assert response.data['throughput'] is not None
+
+
+@pytest.mark.django_db
+def test_import_file_concurrency_limit(provider):
+    """ Тест ограничения числа одновременных импортов поставщика """
+    ImportJob.objects.create(provider=provider[0], file='imports/shop1.yaml')
+    factory = APIRequestFactory()
+    view = ProductViewSet.as_view({'post': 'create'})
+    request = factory.post(reverse("products-list"), {"file": File(open('shop1.yaml'))}, format='multipart')
+    force_authenticate(request, user=provider[0], token=provider[1])
+    response = view(request)
+    assert response.status_code == HTTP_429_TOO_MANY_REQUESTS
 
 
 @pytest.mark.django_db
@@ -49,3 +84,270 @@ def test_get_list_of_orders_by_authenticated_client(import_file_with_products):
     request = factory.get(url)
     response = view(request, pk=product.id)
     assert response.status_code == HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_import_queries_per_chunk(provider):
+    """ Тест постоянного числа запросов на пачку товаров при импорте и повторном импорте """
+    importer = PriceListImporter(provider[0], chunk_size=100)
+    importer.import_categories([{'id': 1, 'name': 'Категория'}])
+    for price in (100, 200):
+        with CaptureQueriesContext(connection) as queries:
+            importer.import_goods(generate_goods(500, price=price))
+        assert len(queries) <= 5 * 8
+    assert importer.processed == 1000
+    assert importer.inserted == 500
+    assert importer.updated == 500
+    assert Product.objects.count() == 500
+    assert Price.objects.filter(provider=provider[0], price=200).count() == 500
+
+
+class CountingStream(io.BytesIO):
+    """ Поток, запоминающий сколько байт из него прочитано """
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read = self.tell()
+        return data
+
+
+def test_price_list_reader_streams_goods():
+    """ Тест потокового чтения товаров прайс-листа до окончания чтения файла """
+    document = {'shop': 'Связной', 'categories': [{'id': 1, 'name': 'Категория'}], 'goods': generate_goods(5000)}
+    content = yaml.safe_dump(document, allow_unicode=True, sort_keys=False).encode()
+    stream = CountingStream(content)
+    price_list = PriceListReader(stream).read_header()
+    goods = price_list.goods()
+    assert price_list.shop == 'Связной'
+    assert price_list.categories == [{'id': 1, 'name': 'Категория'}]
+    assert next(goods)['name'] == 'Товар 0'
+    assert stream.bytes_read < len(content)
+    assert len(list(goods)) == 4999
+
+
+@pytest.mark.django_db
+def test_reimport_writes_only_changed_goods(provider):
+    """ Тест повторного импорта: неизменившиеся товары пропускаются, пропавшие удаляются """
+    categories = [{'id': 1, 'name': 'Категория'}]
+    importer = PriceListImporter(provider[0], chunk_size=100)
+    importer.import_categories(categories)
+    importer.import_goods(generate_goods(300))
+    importer.finish()
+
+    goods = generate_goods(300)
+    goods[0]['price'] = 150
+    del goods[1]
+    importer = PriceListImporter(provider[0], chunk_size=100)
+    importer.import_categories(categories)
+    with CaptureQueriesContext(connection) as queries:
+        importer.import_goods(goods)
+        importer.finish()
+    assert importer.report['changed'] == [0]
+    assert len(importer.report['unchanged']) == 298
+    assert importer.report['removed'] == [1]
+    assert importer.updated == 1
+    assert len(queries) <= 3 * 3 + 5 + 2
+    assert Price.objects.get(provider=provider[0], external_id=0).price == 150
+    assert not Price.objects.filter(provider=provider[0], external_id=1).exists()
+
+
+@pytest.mark.django_db
+def test_reimport_renamed_goods(provider):
+    """ Тест повторного импорта с переименованными товарами и обменом названий: у поставщика остаётся одна цена на
+    продукт, цена прежнего названия удаляется, остальные товары пачки записываются """
+    categories = [{'id': 1, 'name': 'Категория'}]
+    importer = PriceListImporter(provider[0])
+    importer.import_categories(categories)
+    importer.import_goods(generate_goods(5))
+    importer.finish()
+
+    goods = generate_goods(5)
+    goods[0]['name'], goods[1]['name'] = 'Товар 1', 'Товар 0'
+    goods[2]['name'], goods[3]['name'] = 'Товар 3', 'Товар 9'
+    importer = PriceListImporter(provider[0])
+    importer.import_categories(categories)
+    importer.import_goods(goods)
+    importer.finish()
+    assert (importer.failed, importer.updated, importer.inserted) == (0, 3, 1)
+    assert importer.report == {'changed': [0, 1, 2, 3], 'unchanged': [4], 'removed': []}
+    assert set(Price.objects.filter(provider=provider[0]).values_list('external_id', 'product__name')) == {
+        (0, 'Товар 1'), (1, 'Товар 0'), (2, 'Товар 3'), (3, 'Товар 9'), (4, 'Товар 4')
+    }
+
+
+@pytest.mark.django_db
+def test_import_duplicate_goods(provider):
+    """ Тест импорта: повторы id поставщика и названия в пачке считаются ошибочными, первые товары записываются """
+    goods = generate_goods(5)
+    goods[1]['id'] = 0
+    goods[3]['name'] = 'Товар 2'
+    goods.append({'category': 1, 'name': 'Товар 4', 'price': 100})
+    importer = PriceListImporter(provider[0])
+    importer.import_categories([{'id': 1, 'name': 'Категория'}])
+    importer.import_goods(goods)
+    importer.finish()
+    assert (importer.processed, importer.inserted, importer.failed) == (6, 3, 3)
+    assert set(Price.objects.filter(provider=provider[0]).values_list('external_id', 'product__name')) == {
+        (0, 'Товар 0'), (2, 'Товар 2'), (4, 'Товар 4')
+    }
+
+
+@pytest.mark.django_db
+def test_reimport_keeps_offers_of_failed_goods(provider, monkeypatch):
+    """ Тест повторного импорта: товары с ошибкой в полях и товар, на котором падает запись, не удаляются, пачка
+    с таким товаром записывается заново половинами, и ошибочным считается только он """
+    categories = [{'id': 1, 'name': 'Категория'}]
+    importer = PriceListImporter(provider[0], chunk_size=100)
+    importer.import_categories(categories)
+    importer.import_goods(generate_goods(300))
+    importer.finish()
+
+    goods = generate_goods(300)
+    goods[0]['price'] = 'нет цены'
+    goods[100]['price'] = goods[150]['price'] = 150
+    importer = PriceListImporter(provider[0], chunk_size=100)
+    importer.import_categories(categories)
+    import_chunk = importer.import_chunk
+
+    def failing_chunk(chunk):
+        import_chunk(chunk)
+        if any(item['id'] == 100 for item in chunk):
+            raise DatabaseError('duplicate key value violates unique constraint')
+
+    monkeypatch.setattr(importer, 'import_chunk', failing_chunk)
+    importer.import_goods(goods)
+    importer.finish()
+    assert (importer.failed, importer.updated) == (2, 1)
+    assert importer.report['changed'] == [150]
+    assert importer.report['removed'] == []
+    assert Price.objects.filter(provider=provider[0]).count() == 300
+    assert Price.objects.get(provider=provider[0], external_id=100).price == 100
+    assert Price.objects.get(provider=provider[0], external_id=150).price == 150
+
+
+@pytest.mark.django_db
+def test_import_goods_with_invalid_id(provider):
+    """ Тест импорта: товар с id, который не помещается в поле external_id, считается ошибочным, остальные товары
+    пачки записываются """
+    goods = generate_goods(5)
+    goods[1]['id'] = 'abc'
+    goods[2]['id'] = 2 ** 63
+    goods[3]['id'] = True
+    importer = PriceListImporter(provider[0])
+    importer.import_categories([{'id': 1, 'name': 'Категория'}])
+    importer.import_goods(goods)
+    importer.finish()
+    assert (importer.processed, importer.inserted, importer.failed) == (5, 2, 3)
+    assert set(Price.objects.filter(provider=provider[0]).values_list('external_id', flat=True)) == {0, 4}
+
+
+@pytest.mark.django_db
+def test_product_list_query_count(import_file_with_products, django_user_model, django_assert_num_queries):
+    """ Тест фиксированного числа запросов при просмотре списка товаров и отсутствия дублей товаров """
+    second_provider = django_user_model.objects.create_user(username='Евросеть', password='Евросеть', is_staff=True)
+    Price.objects.bulk_create([Price(product=product, provider=second_provider, price=1)
+                               for product in Product.objects.all()])
+    factory = APIRequestFactory()
+    view = ProductViewSet.as_view({'get': 'list'})
+    with django_assert_num_queries(2):
+        response = view(factory.get(reverse("products-list")))
+    assert response.status_code == HTTP_200_OK
+    assert len(response.data['results']) == Product.objects.count()
+    assert all(len(product['providers_info']) == 2 for product in response.data['results'])
+
+    product = Product.objects.first()
+    view = ProductViewSet.as_view({'get': 'retrieve'})
+    with django_assert_num_queries(2):
+        response = view(factory.get(reverse("products-detail", args=(product.id,))), pk=product.id)
+    assert response.status_code == HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_product_list_pagination_and_fields(import_file_with_products, django_assert_num_queries):
+    """ Тест курсорной пагинации и выбора полей в списке товаров """
+    factory = APIRequestFactory()
+    view = ProductViewSet.as_view({'get': 'list'})
+    with django_assert_num_queries(1):
+        response = view(factory.get(reverse("products-list"), {'fields': 'id,name', 'page_size': 3}))
+    assert response.status_code == HTTP_200_OK
+    assert [set(product) for product in response.data['results']] == [{'id', 'name'}] * 3
+    assert response.data['previous'] is None
+
+    response = view(factory.get(response.data['next']))
+    ids = [product['id'] for product in response.data['results']]
+    assert ids == list(Product.objects.order_by('id').values_list('id', flat=True)[3:])
+    assert response.data['next'] is None
+
+
+@pytest.mark.django_db
+def test_product_search_with_facets(import_file_with_products):
+    """ Тест полнотекстового поиска товаров с фасетами по категориям и ценам """
+    factory = APIRequestFactory()
+    view = ProductViewSet.as_view({'get': 'search'})
+    response = view(factory.get('/api/v1/products/search/', {'q': 'iPhone', 'price_max': 70000}))
+    assert response.status_code == HTTP_200_OK
+    assert response.data['count'] == 3
+    assert response.data['facets']['categories'] == [{'id': 224, 'name': 'Смартфоны', 'count': 3}]
+    price_ranges = {(item['min'], item['max']): item['count'] for item in response.data['facets']['price_ranges']}
+    assert price_ranges[(50000, 100000)] == 3
+    assert price_ranges[(100000, None)] == 1
+
+    response = view(factory.get('/api/v1/products/search/', {'q': 'красный', 'category': '224'}))
+    assert [product['name'] for product in response.data['results']] == ['Смартфон Apple iPhone XR 256GB (красный)']
+
+    response = view(factory.get('/api/v1/products/search/', {'q': 'Appl', 'category': '15'}))
+    assert response.data['count'] == 0
+    assert response.data['facets']['categories'][0]['count'] == 4
+
+
+@pytest.mark.django_db
+def test_product_list_parameter_filters(import_file_with_products):
+    """ Тест фильтров списка товаров по параметрам """
+    factory = APIRequestFactory()
+    view = ProductViewSet.as_view({'get': 'list'})
+    product = Product.objects.get(name='Смартфон Apple iPhone XS Max 512GB (золотистый)')
+    assert product.parameters['Встроенная память (Гб)'] == 512
+    assert 'Цвет: золотистый' in product.description
+
+    response = view(factory.get(reverse("products-list"), {'param[Цвет]': 'красный'}))
+    assert [item['name'] for item in response.data['results']] == ['Смартфон Apple iPhone XR 256GB (красный)']
+
+    response = view(factory.get(reverse("products-list"), {'param[Встроенная память (Гб)]__gte': '256'}))
+    assert len(response.data['results']) == 4
+    response = view(factory.get(reverse("products-list"), {'param[Встроенная память (Гб)]__gt': '256'}))
+    assert [item['id'] for item in response.data['results']] == [product.id]
+
+    response = view(factory.get(reverse("products-list"), {'param[Диагональ (дюйм)]': '6.5'}))
+    assert [item['id'] for item in response.data['results']] == [product.id]
+
+    for value in ('nan', 'inf', '-Infinity', '1e400'):
+        response = view(factory.get(reverse("products-list"), {'param[Цвет]': value}))
+        assert response.status_code == HTTP_200_OK
+        assert response.data['results'] == []
+        response = view(factory.get(reverse("products-list"), {'param[Встроенная память (Гб)]__gte': value}))
+        assert response.status_code == HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_catalogue_cache(import_file_with_products, django_assert_num_queries, django_capture_on_commit_callbacks):
+    """ Тест кэширования каталога: повторный запрос без обращения к базе, 304 по ETag, новая версия после изменений """
+    factory = APIRequestFactory()
+    view = ProductViewSet.as_view({'get': 'list'})
+    response = view(factory.get(reverse("products-list")))
+    etag = response['ETag']
+    with django_assert_num_queries(0):
+        response = view(factory.get(reverse("products-list")))
+    assert response.status_code == HTTP_200_OK
+    assert response['ETag'] == etag
+    response = view(factory.get(reverse("products-list"), HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == HTTP_304_NOT_MODIFIED
+
+    importer = PriceListImporter(Price.objects.first().provider)
+    goods = [{'id': 4216292, 'category': 224, 'name': 'Смартфон Apple iPhone XS Max 512GB (золотистый)',
+              'price': 99000, 'parameters': {}}]
+    with django_capture_on_commit_callbacks(execute=True):
+        importer.import_goods(goods)
+    response = view(factory.get(reverse("products-list"), HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == HTTP_200_OK
+    assert response['ETag'] != etag
+    assert response.data['results'][0]['providers_info'][0]['price'] == '99000.00'
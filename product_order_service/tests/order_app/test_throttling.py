@@ -0,0 +1,64 @@
+import redis
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.test import APIRequestFactory
+
+from order_app import throttling
+from order_app.throttling import RedisScopedRateThrottle
+
+
+class OrdersThrottle(RedisScopedRateThrottle):
+    THROTTLE_RATES = {'orders.create': '3/minute'}
+    now = 1000.0
+
+    def timer(self):
+        return self.now
+
+
+class View:
+    throttle_scope = 'orders.create'
+
+
+def check(now):
+    """ Проверка запроса новым экземпляром ограничения, как в отдельном процессе сервера """
+    throttle = OrdersThrottle()
+    throttle.now = now
+    request = APIRequestFactory().post('/api/v1/orders/', REMOTE_ADDR='10.0.0.1')
+    request.user = AnonymousUser()
+    return throttle.allow_request(request, View()), throttle
+
+
+def test_sliding_window(throttle_redis):
+    """ Тест скользящего окна: лимит общий для всех экземпляров, место освобождается через минуту после самого
+    старого запроса окна, а не в начале следующей минуты """
+    assert [check(now)[0] for now in (1000, 1010, 1020)] == [True, True, True]
+    allowed, throttle = check(1030)
+    assert not allowed
+    assert throttle.wait() == 30
+    assert check(1059)[0] is False
+    assert check(1061)[0] is True
+    assert check(1062)[0] is False
+    assert throttle_redis.zcard('throttle_orders.create_10.0.0.1') == 3
+    assert throttle_redis.pttl('throttle_orders.create_10.0.0.1') > 0
+
+
+def test_scopes_are_counted_separately(throttle_redis):
+    """ Тест отдельных счётчиков для разных областей ограничения """
+    for _ in range(3):
+        check(1000)
+
+    class UploadsView:
+        throttle_scope = 'uploads'
+
+    throttle = OrdersThrottle()
+    throttle.THROTTLE_RATES = {'uploads': '1/day'}
+    request = APIRequestFactory().post('/api/v1/products/', REMOTE_ADDR='10.0.0.1')
+    request.user = AnonymousUser()
+    assert throttle.allow_request(request, UploadsView())
+    assert not check(1000)[0]
+
+
+def test_unavailable_redis_allows_requests():
+    """ Тест пропуска запросов, если Redis недоступен """
+    server = redis.Redis(port=1, socket_connect_timeout=0.1)
+    throttling._script = server.register_script(throttling.SLIDING_WINDOW)
+    assert all(check(1000)[0] for _ in range(5))